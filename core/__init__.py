@@ -1,2 +1,9 @@
-from .util import git, process, ssh, config
-from .repo import repo
+import importlib
+
+def __getattr__(name):
+    """Imports core.util, core.repo and the core.util modules on first use"""
+    if name in ("util", "repo"):
+        return importlib.import_module("." + name, __name__)
+    if name.startswith("_"):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    return getattr(importlib.import_module(".util", __name__), name)
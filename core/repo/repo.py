@@ -1,25 +1,54 @@
 from core.util import git
+from core.util import mirror
+from core.util import worktree
+from core.util.config import Config
 import os
 
+def setting(data, config, key):
+    """Returns a repo setting from data, falling back to the config default"""
+    if key in data:
+        return data[key]
+    return getattr(config, key)
+
 class Repo:
-    def __init__(self, data):
+    __slots__ = ("url", "directory", "dirname", "branch", "lock", "mirror",
+        "untracked_cache", "fsmonitor", "depth", "filter", "single_branch",
+        "shallow_submodules", "submodule_jobs", "worktree", "depends_on", "name",
+        "tag", "remote_sha")  # no __dict__, manifests can have thousands of repos
+
+    def __init__(self, data, config=None):
+        if config == None:
+            config = Config({})
         self.url = data["url"]
         self.directory = data["local_dir"]
         self.directory = os.path.join(os.getcwd(), self.directory)
         self.dirname = os.path.dirname(self.directory)
         self.branch = data["branch"]
-        if "lock" in data:
-            self.lock = data["lock"]
-        else:
-            self.lock = True
+        self.lock = setting(data, config, "lock")
+        self.mirror = mirror.root(setting(data, config, "mirror"))
+        self.untracked_cache = setting(data, config, "untracked_cache")
+        self.fsmonitor = setting(data, config, "fsmonitor")
+        self.depth = setting(data, config, "depth")
+        self.filter = setting(data, config, "filter")
+        self.single_branch = setting(data, config, "single_branch")
+        self.shallow_submodules = setting(data, config, "shallow_submodules")
+        self.submodule_jobs = setting(data, config, "submodule_jobs")
+        self.worktree = worktree.root(setting(data, config, "worktree"), os.getcwd())
+        self.depends_on = data.get("depends_on") or []  # repo names run before this one
+        if not isinstance(self.depends_on, list):
+            self.depends_on = [self.depends_on]
         self.name = os.path.basename(self.directory)
         self.tag = None
+        self.remote_sha = None  # branch tip from ls-remote, set by update
 
     def clone(self, verbose=False):
-        git.clone(self, verbose)
+        return git.clone(self, verbose)
+
+    async def clone_async(self):
+        return await git.clone_async(self)
 
-    def clean(self):
-        git.clean(self)
+    def clean(self, locked=False):
+        return git.clean(self, locked)
 
     def add_tag(self, tag):
         git.add_tag(self, tag)
@@ -1,4 +1,14 @@
-from .git import *
-from .process import *
-from .ssh import *
-from .config import *
+import importlib
+
+def __getattr__(name):
+    """Imports a module of core.util on first use
+
+    Nothing is imported with the package, so a command only loads the
+    modules it uses (list doesn't need asyncio, the daemon's inotify or ssh).
+    """
+    try:
+        return importlib.import_module("." + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != "%s.%s" % (__name__, name):
+            raise  # a missing dependency of the module, not the module
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
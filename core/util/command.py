@@ -0,0 +1,157 @@
+import re
+import subprocess
+import time
+from core.util import progress
+from core.util import trace
+
+LINE_END = re.compile(b"(\r\n|\r|\n)")
+
+class CommandResult(object):
+    def __init__(self, args, cwd, returncode, output, elapsed):
+        """Captured outcome of a single command"""
+        self.args = args
+        self.cwd = cwd
+        self.returncode = returncode
+        self.output = output
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+def run(args, cwd=None, env=None, on_line=None):
+    """Runs args in cwd without touching the process working directory
+
+    stdout and stderr are captured together, the returned CommandResult holds
+    the decoded output, exit code and wall time of the command. on_line is
+    called with every line (including carriage return progress updates) as
+    soon as the command prints it.
+    """
+    start = time.time()
+    try:
+        process = subprocess.Popen(args, cwd=cwd, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:  # missing executable or cwd
+        return finish(args, cwd, start, 127, "fatal: %s" % (e,), 0)
+    if on_line == None:
+        raw = process.communicate()[0]
+        output, size = raw.decode("utf-8", "replace"), len(raw)
+    else:
+        lines = LineSplitter(on_line)
+        for chunk in iter(lambda: process.stdout.read1(4096), b""):
+            lines.feed(chunk)
+        process.stdout.close()
+        process.wait()
+        output, size = lines.close(), lines.size
+    return finish(args, cwd, start, process.returncode, output, size)
+
+def finish(args, cwd, start, returncode, output, size):
+    """Builds the CommandResult of a finished command and traces it"""
+    elapsed = time.time() - start
+    trace.command(args, cwd, start, elapsed, returncode, size)
+    return CommandResult(args, cwd, returncode, output, elapsed)
+
+class LineSplitter(object):
+    def __init__(self, on_line):
+        """Splits streamed output on newlines and carriage returns
+
+        Every line is passed to on_line. Lines ending in \n or \r\n are kept
+        as output, bare \r progress updates are not, so they don't end up in
+        error messages.
+        """
+        self.on_line = on_line
+        self.buffer = b""
+        self.output = []
+        self.size = 0  # bytes fed
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        data = self.buffer + chunk
+        held = b""
+        if data.endswith(b"\r"):  # might be the first half of \r\n
+            data, held = data[:-1], b"\r"
+        parts = LINE_END.split(data)
+        self.buffer = parts.pop() + held
+        for i in range(0, len(parts), 2):
+            line = parts[i].decode("utf-8", "replace")
+            self.on_line(line)
+            if parts[i + 1] != b"\r":  # \n or \r\n
+                self.output.append(line + "\n")
+
+    def close(self):
+        if self.buffer != b"":
+            line = self.buffer.decode("utf-8", "replace")
+            self.on_line(line)
+            self.output.append(line)
+            self.buffer = b""
+        return "".join(self.output)
+
+def probe(args, cwd=None, env=None):
+    """Runs args until it prints its first line of output
+
+    Returns that line ("" if the command printed nothing), or None if the
+    command failed. The command is stopped as soon as a line arrives, so
+    callers only pay for as much output as they need.
+    """
+    start = time.time()
+    try:
+        process = subprocess.Popen(args, cwd=cwd, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:  # missing executable or cwd
+        return None
+    line = process.stdout.readline()
+    if line:
+        process.terminate()
+    process.stdout.close()
+    returncode = process.wait()
+    trace.command(args, cwd, start, time.time() - start, returncode, len(line))
+    if returncode != 0 and not line:
+        return None
+    return line.decode("utf-8", "replace").rstrip("\n")
+
+def error(output):
+    """Rewrites git error output as a gpack message"""
+    if "error" in output:
+        return output.replace("error", "gpack").strip()
+    return output.replace("fatal", "gpack").strip()
+
+def run_all(commands, cwd=None, env=None, on_line=None):
+    """Runs commands in order, stopping and printing at the first failure"""
+    for args in commands:
+        result = run(args, cwd, env, on_line)
+        if not result.ok:
+            progress.write(error(result.output))
+            return False
+    return True
+
+async def run_async(args, cwd=None, env=None, on_line=None):
+    """Coroutine version of run driven by asyncio child processes"""
+    import asyncio  # only the async pools need it, keeps startup fast
+    start = time.time()
+    try:
+        process = await asyncio.create_subprocess_exec(*args, cwd=cwd,
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:  # missing executable or cwd
+        return finish(args, cwd, start, 127, "fatal: %s" % (e,), 0)
+    if on_line == None:
+        raw = (await process.communicate())[0]
+        output, size = raw.decode("utf-8", "replace"), len(raw)
+    else:
+        lines = LineSplitter(on_line)
+        while True:
+            chunk = await process.stdout.read(4096)
+            if chunk == b"":
+                break
+            lines.feed(chunk)
+        await process.wait()
+        output, size = lines.close(), lines.size
+    return finish(args, cwd, start, process.returncode, output, size)
+
+async def run_all_async(commands, cwd=None, env=None, on_line=None):
+    """Coroutine version of run_all"""
+    for args in commands:
+        result = await run_async(args, cwd, env, on_line)
+        if not result.ok:
+            progress.write(error(result.output))
+            return False
+    return True
@@ -1,3 +1,19 @@
 class Config(object):
     def __init__(self, data):
-        self.key = data["key"]
+        self.key = data.get("key", False)
+        self.lock = data.get("lock", True)  # default of the per-repo lock setting
+        self.jobs = data.get("jobs")  # repos in flight at once
+        self.host_jobs = data.get("host_jobs")  # repos in flight per remote host
+        self.mirror = data.get("mirror", False)  # shared object store, True or a path
+        self.ls_remote = data.get("ls_remote", False)  # ls-remote before fetching
+        self.untracked_cache = data.get("untracked_cache", False)  # core.untrackedCache on clone
+        self.fsmonitor = data.get("fsmonitor", False)  # core.fsmonitor on clone, True or a hook
+        self.manifest_cache = data.get("manifest_cache", False)  # keep parsed GpackRepos on disk
+        self.depth = data.get("depth")  # shallow clone depth
+        self.filter = data.get("filter")  # partial clone filter, blob:none or tree:0
+        self.single_branch = data.get("single_branch", False)  # only fetch the repo branch
+        self.shallow_submodules = data.get("shallow_submodules", False)  # depth 1 submodules
+        self.submodule_jobs = data.get("submodule_jobs")  # submodules fetched/updated at once
+        self.worktree = data.get("worktree", False)  # branches of one url as worktrees, True or a path
+        self.ssh_multiplex = data.get("ssh_multiplex", False)  # one ssh connection per host
+        self.key_ttl = data.get("key_ttl")  # seconds a downloaded ssh key is cached
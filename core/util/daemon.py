@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from core.util import git
+from core.util import inotify
+from core.util.process import ThreadPool
+
+SOCKET = ".gpack.sock"
+TIMEOUT = 5  # seconds a client waits for an answer before doing the work itself
+
+def socketPath(root):
+    """Returns the daemon socket of a gpack root, in /tmp if the path is too long"""
+    path = os.path.join(root, SOCKET)
+    if len(os.fsencode(path)) < 100:  # sun_path is 108 bytes
+        return path
+    digest = hashlib.sha1(os.fsencode(root)).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), "gpack-%s.sock" % (digest,))
+
+def query(root, request):
+    """Sends a request dict to the daemon of root, returns its answer
+
+    Returns None when no daemon is running, so callers fall back to doing
+    the work themselves.
+    """
+    path = socketPath(root)
+    if not os.path.exists(path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(TIMEOUT)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        answer = client.makefile("rb").readline()
+        return json.loads(answer.decode("utf-8")) if answer else None
+    except (OSError, ValueError):  # stale socket or a daemon going away
+        return None
+    finally:
+        client.close()
+
+def checkState(state):
+    """Returns a daemon repo state as git.check reports it, without head and fetched"""
+    return dict((key, value) for key, value in state.items()
+        if key not in ("head", "fetched"))
+
+class Workspace(object):
+    def __init__(self, root, getManifest, lockState):
+        """In memory state of a gpack root, kept current with inotify
+
+        Every working tree (minus .git), the refs and index of every repo and
+        the GpackRepos and .gpacklock files are watched. A change only marks
+        its repo stale, the state is recomputed on the next request for it.
+        getManifest() and lockState(reload) are the loaders of the gpack
+        command running the daemon.
+        """
+        self.root = root
+        self.getManifest = getManifest
+        self.lockState = lockState
+        self.inotify = inotify.Inotify()
+        self.mutex = threading.RLock()
+        self.watches = {}  # wd -> (repo name or None for root, directory)
+        self.states = {}  # repo name -> state dict
+        self.stale = set()  # repos changed since their state was taken
+        self.unwatched = set()  # repos over the watch limit, always recomputed
+        self.running = True
+        self.load()
+
+    def load(self):
+        """(Re)reads GpackRepos and .gpacklock and watches every repo"""
+        with self.mutex:
+            for wd in self.watches:
+                self.inotify.rm_watch(wd)
+            self.watches = {}
+            self.states = {}
+            self.stale = set()
+            self.unwatched = set()
+            self.manifest = self.getManifest()
+            self.lockState(reload=True)
+            self.watches[self.inotify.add_watch(self.root, inotify.IN_CLOSE_WRITE |
+                inotify.IN_MOVED_TO | inotify.IN_CREATE | inotify.IN_DELETE)] = (None, self.root)
+            for repo in self.manifest.repos:
+                self.watchRepo(repo)
+
+    def watchRepo(self, repo):
+        """Watches the parent, working tree and git refs of repo"""
+        self.stale.add(repo.name)
+        try:
+            if os.path.isdir(repo.dirname):
+                self.watches[self.inotify.add_watch(repo.dirname, inotify.IN_CREATE |
+                    inotify.IN_DELETE | inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM |
+                    inotify.IN_ONLYDIR)] = (repo.name, repo.dirname)
+            if not os.path.isdir(repo.directory):
+                return
+            git_dir = os.path.join(repo.directory, ".git")
+            for directory in [git_dir, os.path.join(git_dir, "refs", "heads"),
+                os.path.join(git_dir, "refs", "remotes", "origin")]:
+                if os.path.isdir(directory):
+                    self.watches[self.inotify.add_watch(directory)] = (repo.name, directory)
+            self.watchTree(repo.name, repo.directory)
+        except OSError:  # out of inotify watches (ENOSPC)
+            self.unwatched.add(repo.name)
+
+    def watchTree(self, name, directory):
+        for path, dirs, files in os.walk(directory):
+            if ".git" in dirs:
+                dirs.remove(".git")
+            self.watches[self.inotify.add_watch(path)] = (name, path)
+
+    def watch(self):
+        """Applies inotify events to the state until stopped
+
+        Any error stops the daemon, its states would no longer be kept
+        current. Clients then fall back to doing the work themselves.
+        """
+        try:
+            while self.running:
+                for wd, mask, name in self.inotify.read():
+                    with self.mutex:
+                        if mask & inotify.IN_Q_OVERFLOW:
+                            self.load()  # events were lost
+                            break
+                        if wd not in self.watches:
+                            continue
+                        repo_name, directory = self.watches[wd]
+                        if mask & inotify.IN_IGNORED:
+                            del self.watches[wd]
+                        elif repo_name == None:
+                            if name == "GpackRepos":
+                                self.load()
+                                break
+                            if name == ".gpacklock":
+                                self.lockState(reload=True)
+                                self.stale.update(self.states)  # lock state is part of it
+                        else:
+                            self.changed(repo_name, directory, mask, name)
+        except Exception as e:
+            sys.stderr.write("gpack daemon: watching %s failed, stopping: %s\n"
+                % (self.root, e))
+            with self.mutex:
+                self.running = False
+
+    def changed(self, name, directory, mask, child):
+        self.stale.add(name)
+        repo = self.manifest.index.get(name)
+        if directory == repo.dirname:
+            if child == os.path.basename(repo.directory) and mask & (inotify.IN_CREATE |
+                inotify.IN_MOVED_TO):
+                self.watchRepo(repo)  # installed or re-cloned
+        elif mask & inotify.IN_ISDIR and mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO) \
+            and child != ".git" and name not in self.unwatched:
+            try:
+                self.watchTree(name, os.path.join(directory, child))
+            except OSError:
+                self.unwatched.add(name)
+
+    def state(self, repo):
+        """Returns the state of repo, recomputed only if it changed"""
+        with self.mutex:
+            fresh = repo.name in self.states and repo.name not in self.stale and \
+                repo.name not in self.unwatched
+            self.stale.discard(repo.name)  # changes from here on mark it again
+            if fresh:
+                return self.states[repo.name]
+        state = git.check(repo, offline=True)
+        state["head"] = None
+        state["fetched"] = None
+        if state["present"]:
+            heads = git.revParse(repo.directory, "HEAD")
+            state["head"] = heads[0] if heads else None
+            try:
+                state["fetched"] = os.stat(os.path.join(repo.directory, ".git",
+                    "FETCH_HEAD")).st_mtime
+            except OSError:
+                pass
+        with self.mutex:
+            self.states[repo.name] = state
+        return state
+
+    def answer(self, request):
+        """Returns the answer dict to one client request"""
+        kind = request.get("request")
+        if not self.running:
+            return {"error": "the daemon is stopping"}  # states may be out of date
+        repos = self.manifest.repos
+        if request.get("repo") != None:
+            repo = self.manifest.index.get(request["repo"])
+            if repo == None:
+                return {"error": "%s is not in GpackRepos" % (request["repo"],)}
+            repos = [repo]
+        if kind == "ping":
+            return {"pid": os.getpid()}
+        if kind == "list":
+            return {"names": [repo.name for repo in repos]}
+        if kind in ("branch", "check"):
+            states = ThreadPool(self.state, repos, 16).results
+            if kind == "branch":
+                return {"branches": dict((state["name"], state["branch"]) for state in states)}
+            return {"states": states}
+        if kind == "stop":
+            self.running = False
+            return {"pid": os.getpid()}
+        return {"error": "unknown request %s" % (kind,)}
+
+def serve(root, getManifest, lockState):
+    """Runs the daemon of root in the foreground until stopped"""
+    path = socketPath(root)
+    if query(root, {"request": "ping"}) != None:
+        print("gpack daemon is already running for %s" % (root,))
+        return
+    workspace = Workspace(root, getManifest, lockState)
+    if os.path.exists(path):
+        os.remove(path)  # left by a daemon that died
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(16)
+    server.settimeout(0.5)  # checks for stop requests
+    threading.Thread(target=workspace.watch, daemon=True).start()
+    ThreadPool(workspace.state, workspace.manifest.repos, 16)  # warm up
+    print("gpack daemon listening on %s" % (path,))
+
+    def handle(client):
+        try:
+            request = json.loads(client.makefile("rb").readline().decode("utf-8"))
+            answer = workspace.answer(request)
+        except Exception as e:
+            answer = {"error": str(e)}
+        try:
+            client.sendall(json.dumps(answer).encode("utf-8") + b"\n")
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+    try:
+        while workspace.running:
+            try:
+                client, address = server.accept()
+            except socket.timeout:
+                continue
+            client.settimeout(None)
+            threading.Thread(target=handle, args=(client,), daemon=True).start()
+        time.sleep(0.1)  # let the stop answer go out
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,120 +1,311 @@
 import os
-import sys
-import subprocess
+import stat
+from types import SimpleNamespace
 import gpack
+from core.util import command
+from core.util import mirror
+from core.util import pins
+from core.util import progress
+from core.util import report
+from core.util import trace
+from core.util import worktree
+from core.util.process import AsyncPool, ThreadPool
 
 ROOT_DIR = os.getcwd()
 
-def rinse(repo):
-    """Performs a clean, reset and recursive update to submodules"""
-    clean = ["git", "clean", "-xdff"]
-    reset = ["git", "reset", "--hard"]
-    sub_clean = ["git", "submodule", "foreach", "--recursive", "git",
-    "clean", "-xdff"]
-    sub_reset = ["git", "submodule", "foreach", "--recursive", "git",
-    "reset", "--hard"]
-    sub_update = ["git", "submodule", "update", "--init", "--recursive"]
-    directory = repo.directory
-    branch = "origin/" + repo.branch
+PATHS_PER_COMMAND = 1000  # paths passed on one git command line
+
+@trace.traced("rinse")
+def rinse(repo, locked=False, target=None):
+    """Brings the checkout of repo back to target (origin/<branch>)
+
+    Only what porcelain status reports is touched: changed tracked paths are
+    restored, untracked and ignored ones removed and dirty submodules rinsed
+    the same way. With locked, only those paths are unlocked for the
+    operation and locked again afterwards. Returns success.
+    """
+    touched = []  # repo relative paths unlocked so far
 
-    os.chdir(directory)
+    def permit(paths):
+        if locked and paths:
+            gpack.applyPerms(repo, "unlock", paths)
+            touched.extend(paths)
 
     try:
-        subprocess.check_output(clean, stderr=subprocess.STDOUT)
-        subprocess.check_output(reset+[branch], stderr=subprocess.STDOUT)
-        subprocess.check_output(sub_clean, stderr=subprocess.STDOUT)
-        subprocess.check_output(sub_reset, stderr=subprocess.STDOUT)
-        subprocess.check_output(sub_update, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        print(e.output.decode("utf-8").replace("fatal", "gpack").strip())
+        return rinseTree(repo, repo.directory, target or "origin/" + repo.branch,
+            permit)
+    finally:
+        if touched:
+            gpack.applyPerms(repo, "lock", touched)
+
+def rinseTree(repo, directory, target, permit, prefix=""):
+    """Targeted rinse of one working tree, submodules are rinsed recursively
+
+    permit(paths) is called with the paths, relative to the repo and prefixed
+    with prefix, before they are changed.
+    """
+    status = dirtyPaths(directory)
+    if status == None:
+        return False
+    tracked, untracked, submodules, unmerged = status
+    heads = revParse(directory, "HEAD", target)
+    if heads == None:
+        return False
+    prefixed = lambda paths: [os.path.join(prefix, path) for path in paths]
 
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
+    if heads[0] != heads[1] or unmerged:
+        moved = changedPaths(directory, "HEAD", target) or []
+        permit(prefixed(moved + tracked))
+        if not command.run_all([["git", "reset", "-q", "--hard", target]], cwd=directory):
+            return False
+        submodules.update(dict((path, "SC..") for path in moved
+            if os.path.isfile(os.path.join(directory, path, ".git"))))
+    elif tracked:
+        permit(prefixed(tracked))
+        restore = ["git", "--literal-pathspecs", "restore", "--source=HEAD",
+            "--staged", "--worktree", "--"]
+        if not runPaths(restore, tracked, directory):
+            return False
+    if untracked:
+        permit(prefixed(untracked))
+        if not runPaths(["git", "--literal-pathspecs", "clean", "-xdffq", "--"],
+            untracked, directory):
+            return False
+
+    dirty = [path for path, flags in sorted(submodules.items())
+        if flags[2:] != ".."]  # changes inside the submodule
+    rinseSubmodule = lambda path: rinseTree(repo, os.path.join(directory, path),
+        "HEAD", permit, os.path.join(prefix, path))
+    if repo.submodule_jobs and len(dirty) > 1:
+        results = ThreadPool(rinseSubmodule, dirty, repo.submodule_jobs).results
+    else:
+        results = [rinseSubmodule(path) for path in dirty]
+    if not all(results):
+        return False
+    update = [path for path, flags in sorted(submodules.items())
+        if flags[1] == "C"]  # checked out at another commit
+    if update or (heads[0] != heads[1] and hasSubmodules(repo)):
+        permit(prefixed(update))
+        sub_update = ["git", "submodule", "update", "--init", "--recursive"] + \
+            submodule_options(repo) + ["--"] + update
+        if not command.run_all([sub_update], cwd=directory):
+            return False
+    return True
 
-def clean(repo):
-    """Performs a clean to submodules"""
-    rinse(repo)
+def dirtyPaths(directory):
+    """Returns (tracked, untracked, submodules, unmerged) of a working tree
+
+    tracked and untracked (ignored included) are path lists, submodules maps
+    the path of every changed submodule to its porcelain v2 S<c><m><u> flags.
+    Returns None if git status fails.
+    """
+    status = ["git", "--no-optional-locks", "status", "--porcelain=v2", "-z",
+        "--untracked-files=normal", "--ignored=traditional", "--no-renames"]
+    result = command.run(status, cwd=directory)
+    if not result.ok:
+        return None
+    tracked, untracked, submodules, unmerged = [], [], {}, False
+    for entry in result.output.split("\0"):
+        if entry[:2] in ("? ", "! "):
+            untracked.append(entry[2:].rstrip("/"))
+        elif entry[:2] == "1 ":
+            fields = entry.split(" ", 8)
+            if fields[2][0] == "S":
+                submodules[fields[8]] = fields[2]
+            else:
+                tracked.append(fields[8])
+        elif entry[:2] == "u ":
+            unmerged = True
+    return tracked, untracked, submodules, unmerged
+
+def runPaths(args, paths, directory):
+    """Runs args with paths appended, split across several commands if long"""
+    for i in range(0, len(paths), PATHS_PER_COMMAND):
+        if not command.run_all([args + paths[i:i + PATHS_PER_COMMAND]], cwd=directory):
+            return False
+    return True
 
+def hasSubmodules(repo):
+    """Checks if the repo checkout declares any submodules"""
+    return os.path.isfile(os.path.join(repo.directory, ".gitmodules"))
+
+def submoduleHeads(repo):
+    """Returns {path: checked out SHA} of all initialized submodules"""
+    result = command.run(["git", "submodule", "status", "--recursive"],
+        cwd=repo.directory)
+    heads = {}
+    for line in result.output.splitlines() if result.ok else []:
+        if line == "" or line[0] == "-":  # not initialized
+            continue
+        sha, path = line[1:].split(" ", 1)
+        if path.endswith(")"):
+            path = path.rsplit(" (", 1)[0]  # drop the describe output
+        heads[path] = sha
+    return heads
+
+def needed(repo, args):
+    """Checks if a step has to run, submodule steps are skipped without .gitmodules"""
+    return "submodule" not in args[1:3] or hasSubmodules(repo)
+
+def clean(repo, locked=False):
+    """Performs a clean to submodules, returns success"""
+    return rinse(repo, locked)
+
+def run_job(repo, steps, phase, message=None):
+    """Runs (command, cwd) steps as one job of the live progress display"""
+    display = progress.display()
+    display.start(repo.name, phase)
+    ok = True
+    for args, cwd in steps:
+        if not needed(repo, args):
+            continue
+        if not command.run_all([args], cwd=cwd,
+            on_line=lambda line: display.line(repo.name, line)):
+            ok = False
+            break
+    display.finish(repo.name, message if ok else None)
+    return ok
+
+def status_config(repo):
+    """Returns clone arguments enabling the untracked cache and fsmonitor"""
+    config = []
+    if repo.untracked_cache:
+        config += ["-c", "core.untrackedCache=true"]
+    if repo.fsmonitor:
+        config += ["-c", "core.fsmonitor=%s" % ("true" if repo.fsmonitor == True else repo.fsmonitor,)]
+    return config
+
+def history_options(repo):
+    """Returns clone arguments for the depth, filter and single_branch settings"""
+    options = []
+    if repo.depth:
+        options += ["--depth", str(repo.depth)]
+    if repo.filter:
+        options += ["--filter=%s" % (repo.filter,)]
+    if repo.single_branch:
+        options += ["--single-branch"]
+    if repo.depth or repo.single_branch:
+        options += ["--branch", repo.branch]  # the only branch that is fetched
+    if repo.shallow_submodules:
+        options += ["--shallow-submodules"]
+    return options
+
+def submodule_options(repo):
+    """Returns submodule update arguments for the submodule settings"""
+    options = []
+    if repo.shallow_submodules:
+        options += ["--depth", "1"]
+    if repo.submodule_jobs:
+        options += ["--jobs", str(repo.submodule_jobs)]
+    return options
+
+def parallel_config(repo):
+    """Returns -c arguments fetching submodules and remotes in parallel"""
+    if not repo.submodule_jobs:
+        return []
+    return ["-c", "submodule.fetchJobs=%s" % (repo.submodule_jobs,),
+        "-c", "fetch.parallel=%s" % (repo.submodule_jobs,)]
+
+def fetch_options(repo):
+    """Returns fetch arguments that keep a shallow clone at its depth"""
+    if repo.depth:
+        return ["--depth", str(repo.depth)]
+    return []
+
+def clone_options(repo):
+    """Returns all git clone arguments for repo besides url and directory"""
+    options = ["--recursive"] + mirror.reference(repo) + status_config(repo) + \
+        history_options(repo) + parallel_config(repo)  # -c is kept in the clone
+    if repo.submodule_jobs:
+        options += ["--jobs", str(repo.submodule_jobs)]
+    return options
+
+def clone_steps(repo, verbose=False):
+    """Returns the (command, cwd) steps of a clone
+
+    For a worktree repo these are the steps after worktree.add.
+    """
+    sub_check = ["git", "submodule", "foreach", "git", "checkout"]
+    if repo.worktree:
+        steps = [(["git", "submodule", "update", "--init", "--recursive"] +
+            submodule_options(repo), repo.directory)]
+        if not repo.shallow_submodules:
+            steps.append((sub_check+[repo.branch], repo.directory))
+        return steps
+    clone = ["git", "clone"] + clone_options(repo)
+    if verbose:
+        clone.append("--progress")
+    check = ["git", "checkout"]
+    steps = [(clone+[repo.url, repo.name], repo.dirname),
+        (check+[repo.branch], repo.directory)]
+    if not repo.shallow_submodules:  # shallow submodules only have their pinned commit
+        steps.append((sub_check+[repo.branch], repo.directory))
+    return steps
+
+@trace.traced("clone")
 def clone(repo, verbose):
-    """Spawns terminal for each repo, showing clone output"""
-    _name = repo.name
-    _url = repo.url
-    _dir = repo.directory
-    _branch = repo.branch
+    """Clones repo, verbose shows its progress in the live display
 
-    os.chdir(repo.dirname)
+    Returns success.
+    """
+    _name = repo.name
 
+    if repo.worktree and not worktree.add(repo):
+        return False
     if verbose:
-        CLONE="git clone --recursive %s %s" % (_url, _name)
-        DIR="cd %s" % (_dir,)
-        CHECKOUT="git checkout %s" % (_branch,)
-        SUB_MODULES="git submodule foreach git checkout %s" % (_branch,)
-        COMMAND = "%s && %s && %s && %s" % (CLONE, DIR, CHECKOUT, SUB_MODULES)
-        try:
-            os.system("xterm -T %s -geometry 90x30 -e \"%s || read -p 'Press return to close window'\"" % (_dir, COMMAND,))
-        except subprocess.CalledProcessError as e:
-            e = e.output.decode("utf-8")
-            if "error" in e:
-                print(e.replace("error", "gpack").strip())
-            else:
-                print(e.replace("fatal", "gpack").strip())
-        else:
-            print("Successfully installed %s..." % (_name))
-    else:
-        clone = ["git", "clone", "--recursive"]
-        check = ["git", "checkout"]
-        sub_check = ["git", "submodule", "foreach", "git", "checkout"]
-        try:
-            subprocess.check_output(clone+[_url, repo.name], stderr=subprocess.STDOUT)
-            os.chdir(_dir)
-            subprocess.check_output(check+[_branch],stderr=subprocess.STDOUT)
-            subprocess.check_output(sub_check+[_branch],stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            e = e.output.decode("utf-8")
-            if "error" in e:
-                print(e.replace("error", "gpack").strip())
-            else:
-                print(e.replace("fatal", "gpack").strip())
-        else:
-            print("Successfully installed %s..." % (_name))
-
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
+        return run_job(repo, clone_steps(repo, verbose), "cloning",
+            "Successfully installed %s..." % (_name))
+    for args, cwd in clone_steps(repo):
+        if not needed(repo, args):
+            continue
+        if not command.run_all([args], cwd=cwd):
+            return False
+    progress.write("Successfully installed %s..." % (_name))
+    return True
 
-def pull(repo):
-    os.chdir(repo.directory)  # move to repo dir
-    pull = "git pull".split(" ")
-    sub = "git submodule update --recursive".split(" ")
-    try:
-        subprocess.check_output(pull, stderr=subprocess.STDOUT)
-        subprocess.check_output(sub, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        e = e.output.decode("utf-8")
-        if "error" in e:
-            print(e.replace("error", "gpack").strip())
-        else:
-            print(e.replace("fatal", "gpack").strip())
+@trace.traced("clone")
+async def clone_async(repo):
+    """Coroutine version of the non-verbose clone for AsyncPool"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if repo.worktree and not await loop.run_in_executor(None, worktree.add, repo):
+        return False
+    steps = await loop.run_in_executor(None, clone_steps, repo)  # syncs the mirror
+    for args, cwd in steps:
+        if not needed(repo, args):
+            continue
+        if not await command.run_all_async([args], cwd=cwd):
+            return False
+    progress.write("Successfully installed %s..." % (repo.name))
+    return True
 
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
+def pull_steps(repo):
+    """Returns the commands bringing a fetched repo to origin/<branch>"""
+    if repo.depth:  # shallow histories can't be merged, move to the fetched tip
+        pull = ["git", "reset", "--hard", "origin/" + repo.branch]
+    elif repo.worktree:  # already fetched by worktree.sync, no upstream to pull
+        pull = ["git", "merge", "--ff-only", "origin/" + repo.branch]
+    else:
+        pull = ["git"] + mirror.redirect(repo) + ["pull", "--progress"]
+    sub = "git submodule update --recursive".split(" ") + submodule_options(repo)
+    return [pull, sub]
 
 def current_branch(repo):
     """Returns the current branch that a repo is on"""
     branch = "git rev-parse --abbrev-ref HEAD".split(" ")
-    try:
-        process = subprocess.check_output(branch)
-    except subprocess.CalledProcessError as e:
+    result = command.run(branch, cwd=repo.directory)
+    if not result.ok:
         return ""
-    return process.decode("utf-8")
+    return result.output
 
 def check_branch(repo):
     """Checks the current branch on repo"""
-    os.chdir(repo.directory)  # move to repo dir
     branch = current_branch(repo).strip()  # get cur branch
     print("'%s' is currently on branch '%s'" % (repo.name, branch))
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
 
 def push(repo):
     """Push local changes"""
 
-    os.chdir(repo.directory)  # move to repo dir
     branch = current_branch(repo).strip()  # get cur branch
 
     if(branch == "master"):
@@ -126,181 +317,294 @@ def push(repo):
     commit = ["git", "commit", "-m", msg]
     p = ["git", "push", "--set-upstream", "origin", branch.strip()]
 
-    try:
-        subprocess.check_output(add, stderr=subprocess.STDOUT)
-        subprocess.check_output(commit, stderr=subprocess.STDOUT)
-        subprocess.check_output(p, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:  # if nothing on branch
-        print("\nOn branch " + branch)
-        print("Your branch is up-to-date")
-        print("Nothing to commit, working directory clean")
-
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
+    for args in [add, commit, p]:
+        if not command.run(args, cwd=repo.directory).ok:  # if nothing on branch
+            print("\nOn branch " + branch)
+            print("Your branch is up-to-date")
+            print("Nothing to commit, working directory clean")
+            break
 
 def add_tag(repo, tag):
     """Checksout a specific tag and creates branch at tag"""
     add = ["git", "tag", "-a", tag, "-m", "'%s created by gpack'"]
-    os.chdir(repo.directory)
-
-    try:
-        subprocess.check_output(add, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        e = e.output.decode("utf-8")
-        if "error" in e:
-            print(e.replace("error", "gpack").strip())
-        else:
-            print(e.replace("fatal", "gpack").strip())
-
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
-
-def check(repos):
-    """Checks if all tracked repos are clean and up-to-date"""
-    for repo in repos:
-        print(repo.name)
+    command.run_all([add], cwd=repo.directory)
+
+@trace.traced("check")
+def check(repo, offline=False):
+    """Returns the workspace state of repo as a dict for report.checks
+
+    Branch, changes, ahead/behind and submodule drift all come from a single
+    git status call. Unless offline, origin/<branch> is fetched first so the
+    counts are against the remote rather than the last fetch.
+    """
+    state = {"name": repo.name, "directory": repo.directory,
+        "present": os.path.isdir(repo.directory), "branch": None,
+        "expected_branch": repo.branch, "changes": 0, "ahead": None,
+        "behind": None, "submodules": [], "locked": None,
+        "expected_locked": repo.lock != False and repo.directory not in gpack.lockState(),
+        "error": None, "ok": False}
+    if not state["present"]:
+        return state
+    state["locked"] = not os.stat(repo.directory).st_mode & stat.S_IWUSR
+
+    if not offline:
+        fetch = ["git", "fetch", "--quiet", "--no-tags"] + fetch_options(repo) + \
+            ["origin", repo.branch]
+        result = command.run(fetch, cwd=repo.directory)
+        if not result.ok:
+            state["error"] = command.error(result.output).strip()
+    status = ["git", "--no-optional-locks", "status", "--porcelain=v2", "--branch",
+        "--untracked-files=normal", "--no-renames"]
+    result = command.run(status, cwd=repo.directory)
+    if not result.ok:
+        state["error"] = command.error(result.output).strip()
+        return state
+
+    upstream = None
+    for line in result.output.splitlines():
+        if line.startswith("# branch.head "):
+            state["branch"] = line.split(" ", 2)[2]
+        elif line.startswith("# branch.upstream "):
+            upstream = line.split(" ", 2)[2]
+        elif line.startswith("# branch.ab "):
+            ahead, behind = line.split(" ")[2:4]
+            state["ahead"], state["behind"] = int(ahead), -int(behind)
+        elif line[:2] in ("1 ", "2 ", "u "):
+            fields = line.split(" ", 3)
+            if fields[1] == ".M" and fields[2][:2] == "SC" and fields[2][2:] == "..":
+                state["submodules"].append(line.split(" ", 8)[8])  # only its commit moved
+            else:
+                state["changes"] += 1
+        elif line.startswith("? "):
+            state["changes"] += 1
+
+    if state["branch"] != repo.branch or upstream != "origin/" + repo.branch:
+        counts = aheadBehind(repo)  # branch.ab is against another upstream
+        state["ahead"], state["behind"] = counts if counts != None else (None, None)
+    state["ok"] = state["error"] == None and state["branch"] == repo.branch and \
+        state["changes"] == 0 and state["ahead"] == 0 and state["behind"] == 0 and \
+        state["locked"] == state["expected_locked"] and state["submodules"] == []
+    return state
 
 def checkout(repo, branch):
     """Checkout a branch"""
     check = ("git checkout %s" % (branch,)).split(" ")
     create =("git checkout -b %s" % (branch,)).split(" ")
 
-    os.chdir(repo.directory)
-    try:
-        subprocess.check_output(checkout, stderr=subprocess.STDOUT)
-        subprocess.check_output(branch, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        e = e.output.decode("utf-8")
-        if "error" in e:
-            print(e.replace("error", "gpack").strip())
-        else:
-            print(e.replace("fatal", "gpack").strip())
-
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
-
-    try:
-        subprocess.check_output(check, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
+    if not command.run(check, cwd=repo.directory).ok:
         print("'%s' does not exist, would you like to create '%s'" % (branch,branch))
         ans = input("[y/n]: ")
         if(ans.lower() == "y" or ans.lower() == "yes"):
-            try:
-                subprocess.check_output(create, stderr=subprocess.STDOUT)
-            except subprocess.CalledProcessError as e:
+            if not command.run(create, cwd=repo.directory).ok:
                 print("Error checkout out %s" % (branch,))
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
 
 def checkout_tag(repo, tag):
     """Checksout a specific tag and creates branch at tag"""
     checkout = ["git", "checkout", "tags/%s"%(tag,)]
     branch = ["git", "checkout", "-b", "build_%s" % (tag,)]
-    os.chdir(repo.directory)
+    command.run_all([checkout, branch], cwd=repo.directory)
+
+@trace.traced("fetch")
+def fetch(repo):
+    """Performs a git fetch in the repo, from its mirror if it has one, returns success"""
+    if repo.worktree:  # one fetch of the shared clone for all its worktrees
+        return worktree.sync(repo) != None
+    fetch = ["git"] + mirror.redirect(repo) + parallel_config(repo) + \
+        ["fetch", "--progress"] + fetch_options(repo)
+    return run_job(repo, [(fetch, repo.directory)], "fetching")
+
+@trace.traced("update")
+def update(repo):
+    """Performs update flow diagram on repo
 
-    try:
-        subprocess.check_output(checkout, stderr=subprocess.STDOUT)
-        subprocess.check_output(branch, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        e = e.output.decode("utf-8")
-        if "error" in e:
-            print(e.replace("error", "gpack").strip())
-        else:
-            print(e.replace("fatal", "gpack").strip())
+    Returns a report status for the repo, or False if the repo could not be
+    brought back to a clean state and has to be re-cloned.
+    """
+    directory = repo.directory
+    locked = directory not in gpack.lockState()
+    status = report.CURRENT
 
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
+    if not localClean(directory):
+        if locked == False:
+            return report.SKIPPED  # unlocked and not clean
+        if not rinse(repo, locked):
+            return False
+        status = report.RINSED
+    if repo.remote_sha == None or revParse(directory, "HEAD") != [repo.remote_sha]:
+        if not fetch(repo):  # syncs the mirror once per url
+            return report.FAILED
+        if not commitsMatch(repo) and locked and behind(repo):
+            paths = changedPaths(directory, "HEAD", "origin/" + repo.branch)
+            gpack.applyPerms(repo, "unlock", paths)  # only what the pull touches
+            try:
+                pulled = run_job(repo, [(args, directory) for args in pull_steps(repo)],
+                    "pulling")
+            finally:
+                gpack.applyPerms(repo, "lock", paths)  # re-lock pulled paths
+            if not pulled:
+                return False  # diverged or conflicting, HEAD did not move
+            if status != report.RINSED:
+                status = report.UPDATED
+            if not localClean(directory):
+                if not rinse(repo, locked) or not localClean(directory):
+                    return False
+                status = report.RINSED
+    return status
+
+def pin(repo):
+    """Returns the lockfile pin of the current checkout of repo"""
+    shas = revParse(repo.directory, "HEAD")
+    if shas == None:
+        return None
+    submodules = submoduleHeads(repo) if hasSubmodules(repo) else {}
+    return pins.pin(repo, shas[0], submodules)
+
+def pinned(repo, pin):
+    """Checks if repo and its submodules are checked out at pin, offline"""
+    if revParse(repo.directory, "HEAD") != [pin["sha"]]:
+        return False
+    if not pin.get("submodules"):
+        return True
+    return submoduleHeads(repo) == pin["submodules"]
 
-def fetch():
-    """Performs a git pull on all repos in the testing dir"""
-    fetch = ["git", "fetch"]
+def fetchSha(repo, directory, sha):
+    """Makes sure commit sha exists in directory, fetching only it if missing"""
+    if revParse(directory, sha) == [sha]:
+        return True
+    fetch = ["git", "fetch", "--no-tags"] + fetch_options(repo) + ["origin", sha]
+    return command.run_all([fetch], cwd=directory)
 
-    try:
-        subprocess.check_output(fetch, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        e = e.output.decode("utf-8")
-        if "error" in e:
-            print(e.replace("error", "gpack").strip())
-        else:
-            print(e.replace("fatal", "gpack").strip())
+@trace.traced("frozen")
+def frozen(repo, pin):
+    """Moves repo and its submodules to the commits of pin
 
-def update(repo):
-    """Performs update flow diagram on repo"""
+    Unlike update nothing is fetched by branch, commits missing locally are
+    fetched by SHA. Returns a report status.
+    """
     directory = repo.directory
-    os.chdir(directory)
-    locked = False
-    with open(ROOT_DIR + "/.gpacklock", "r") as f:
-        if directory not in [line.strip() for line in f.readlines()]:
-            locked = True
-
-    print("gpack: updating %s, please be patient..." % (repo.name,))
+    locked = directory not in gpack.lockState()
+    status = report.UPDATED
 
-    if not localClean():
+    if not localClean(directory):
         if locked == False:
-            print("\t" + repo.name + " is unlocked and not clean...")
-            return True
-        print("\t" + repo.name + " not clean, rinsing...")
-        gpack.unlock(repo)
-        rinse(repo)
-    fetch()
-    if not commitsMatch(repo) and locked:
-        print("\t" + repo.name + " commits don't match, pulling...")
-        gpack.unlock(repo)
-        COMMAND = "git pull && git submodule update --recursive"
-        os.system("xterm -T %s -geometry 90x30 -e \"%s || read -p 'Press return to close window'\"" % (repo.directory, COMMAND,))
-        print("Successfully pulled %s..." % (repo.name,))#pull(repo)
-        if not localClean():
-            print("\t" + repo.name + " not clean, rinsing...")
-            rinse(repo)
-            if not localClean():
-                print("\t" + repo.name + " not clean, resetting...")
-                return False
+            return report.SKIPPED  # unlocked and not clean
+        if not rinse(repo, locked, "HEAD"):
+            return report.FAILED
+        status = report.RINSED
+    if not fetchSha(repo, directory, pin["sha"]):
+        return report.FAILED
+    paths = changedPaths(directory, "HEAD", pin["sha"])
     if locked:
-        gpack.lock(repo)  # re-lock repo
-    return True
-
-
+        gpack.applyPerms(repo, "unlock", paths)  # only what the reset touches
+    try:
+        if not command.run_all([["git", "reset", "-q", "--hard", pin["sha"]]],
+            cwd=directory):
+            return report.FAILED
+
+        if hasSubmodules(repo):
+            update = ["git", "submodule", "update", "--init", "--recursive"] + \
+                submodule_options(repo)
+            command.run_all([update], cwd=directory)
+            heads = submoduleHeads(repo)
+            for path, sha in sorted(pin.get("submodules", {}).items()):
+                if heads.get(path) == sha:
+                    continue
+                submodule = os.path.join(directory, path)
+                if locked and paths != None:
+                    paths.append(path)
+                    gpack.applyPerms(repo, "unlock", [path])
+                if not fetchSha(repo, submodule, sha) or not command.run_all(
+                    [["git", "checkout", "-q", "--detach", sha]], cwd=submodule):
+                    return report.FAILED
+    finally:
+        if locked:
+            gpack.applyPerms(repo, "lock", paths)  # re-lock, also after a failure
+    return status
+
+@trace.traced("changedPaths")
+def changedPaths(directory, old, new):
+    """Returns the paths that differ between two commits, None on failure"""
+    diff = ["git", "diff", "--name-only", "--no-renames", "-z", old, new]
+    result = command.run(diff, cwd=directory)
+    if not result.ok:
+        return None
+    return [path for path in result.output.split("\0") if path != ""]
+
+def revParse(directory, *revs):
+    """Returns the commit SHAs of revs in directory, None if any is missing"""
+    result = command.run(["git", "rev-parse"] + [rev + "^{commit}" for rev in revs],
+        cwd=directory)
+    if not result.ok:
+        return None
+    return result.output.split()
+
+@trace.traced("commitsMatch")
 def commitsMatch(repo):
     """Checks to see if commits match between local repo and remote"""
-    branch = repo.branch
-    log = ["git", "log"]
-    log_remote = ["git", "log", "origin/" + branch]
-
-    try:
-        local = subprocess.check_output(log, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        return False
-
-    try:
-        remote = subprocess.check_output(log_remote, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        return False
-
-    if local == remote:
-        return True
-    else:
+    shas = revParse(repo.directory, "HEAD", "origin/" + repo.branch)
+    if shas == None:
         return False
+    return shas[0] == shas[1]
+
+def aheadBehind(repo):
+    """Returns (ahead, behind) commit counts of HEAD against origin/<branch>"""
+    counts = ["git", "rev-list", "--left-right", "--count",
+        "HEAD...origin/" + repo.branch]
+    result = command.run(counts, cwd=repo.directory)
+    if not result.ok:
+        return None
+    ahead, behind = result.output.split()
+    return int(ahead), int(behind)
+
+def behind(repo):
+    """Checks if origin/<branch> has commits that HEAD does not"""
+    counts = aheadBehind(repo)
+    return counts == None or counts[1] > 0
+
+def lsRemote(url, branches):
+    """Returns {branch: sha} of the given branches on a remote"""
+    refs = ["refs/heads/" + branch for branch in branches]
+    result = command.run(["git", "ls-remote", url] + refs)
+    heads = {}
+    if not result.ok:
+        return heads
+    for line in result.output.splitlines():
+        sha, _, ref = line.partition("\t")
+        if ref.startswith("refs/heads/"):
+            heads[ref[len("refs/heads/"):]] = sha
+    return heads
+
+@trace.traced("ls-remote")
+def remoteHeads(repos, jobs=None, host_jobs=None):
+    """Sets repo.remote_sha from one ls-remote per unique url
+
+    Repos whose HEAD already equals remote_sha skip fetching during update.
+    The calls share the jobs and host_jobs caps of the other remote traffic.
+    """
+    branches = {}
+    for repo in repos:
+        branches.setdefault(repo.url, set()).add(repo.branch)
+    urls = sorted(branches)
+    remotes = [SimpleNamespace(name=url, url=url, depends_on=[]) for url in urls]
+    pool = AsyncPool(lambda remote: lsRemote(remote.url, sorted(branches[remote.url])),
+        remotes, jobs, host_jobs)
+    heads = dict(zip(urls, pool.results))
+    for repo in repos:
+        repo.remote_sha = heads[repo.url].get(repo.branch)
 
-def localClean():
+@trace.traced("localClean")
+def localClean(directory):
     """Checks to see if the local directory is clean"""
-    status = ["git", "status", "-u"]
-    clean = "nothing to commit, working directory clean"
-
-    try:
-        output = subprocess.check_output(status, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        return False
-    else:
-        if clean in output.decode("utf-8"):
-            return True
-        else:
-            return False
+    status = ["git", "--no-optional-locks", "status", "--porcelain=v2",
+        "--untracked-files=normal", "--no-renames"]
+    return command.probe(status, cwd=directory) == ""  # any line means dirty
 
 def viewTags(repo):
     """Returns all available tags for a repo"""
     tag = ["git", "tag", "-l"]
-    os.chdir(repo.directory)
-    try:
-        process = subprocess.check_output(tag)
-    except subprocess.CalledProcessError as e:
+    result = command.run(tag, cwd=repo.directory)
+    if not result.ok:
         return []
-    output = process.decode("utf-8")
-    tags = output.split("\n")
+    tags = result.output.split("\n")
     tags = [tag for tag in tags if tag != ""]  # remove blank tag
-    os.chdir(ROOT_DIR)  # Go back to ROOT_DIR after clone
     return tags
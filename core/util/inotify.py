@@ -0,0 +1,77 @@
+import errno
+import os
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+CHANGES = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+_libc = None
+
+def libc():
+    """Returns the C library, which has the inotify calls on Linux"""
+    global _libc
+    if _libc == None:
+        import ctypes  # only the daemon calls inotify
+        _libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(_libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+    return _libc
+
+def failure(*args):
+    """Returns the OSError of the last failed libc call"""
+    import ctypes
+    error = ctypes.get_errno()
+    return OSError(error, os.strerror(error), *args)
+
+class Inotify(object):
+    def __init__(self):
+        """inotify instance through ctypes, Linux only"""
+        self.fd = libc().inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise failure()
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=CHANGES):
+        """Watches path, returns its watch descriptor"""
+        wd = libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise failure(path)
+        return wd
+
+    def rm_watch(self, wd):
+        libc().inotify_rm_watch(self.fd, wd)  # fails for already removed watches
+
+    def read(self):
+        """Blocks for events, returns a list of (wd, mask, name)"""
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,117 @@
+import contextlib
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks, writes are still atomic
+    fcntl = None
+
+class LockState(object):
+    def __init__(self, path):
+        """Set of unlocked repo directories kept in a .gpacklock file
+
+        The file is read once, lookups and changes happen in memory. Changes
+        are written back atomically (temp file + rename) under an advisory
+        lock, merged with whatever other gpack processes wrote meanwhile.
+        Inside batch() nothing is written until the outermost batch ends.
+        """
+        self.path = path
+        self._mutex = threading.RLock()
+        self._depth = 0
+        self._added = set()
+        self._removed = set()
+        self.unlocked = self._read()
+
+    def __contains__(self, directory):
+        with self._mutex:
+            return directory in self.unlocked
+
+    def add(self, directory):
+        """Marks directory as unlocked"""
+        with self._mutex:
+            if directory in self.unlocked:
+                return
+            self.unlocked.add(directory)
+            self._added.add(directory)
+            self._removed.discard(directory)
+            self._changed()
+
+    def remove(self, directory):
+        """Marks directory as locked"""
+        with self._mutex:
+            if directory not in self.unlocked:
+                return
+            self.unlocked.discard(directory)
+            self._removed.add(directory)
+            self._added.discard(directory)
+            self._changed()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defers writing the file until the outermost batch ends"""
+        with self._mutex:
+            self._depth += 1
+        try:
+            yield self
+        finally:
+            with self._mutex:
+                self._depth -= 1
+                self._changed()
+
+    def save(self):
+        """Writes pending changes to the file"""
+        with self._mutex:
+            if not self._added and not self._removed:
+                return
+            with self._guard():
+                unlocked = self._read() | self._added  # keep other writers' entries
+                unlocked -= self._removed
+                self._write(unlocked)
+            self.unlocked = unlocked
+            self._added = set()
+            self._removed = set()
+
+    @contextlib.contextmanager
+    def _guard(self):
+        """Holds an exclusive flock on the directory of the file
+
+        The directory itself is locked, the file is replaced on every write
+        and a separate lock file would be left in the workspace.
+        """
+        if fcntl == None:
+            yield
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _changed(self):
+        if self._depth == 0:
+            self.save()
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return set([line.strip() for line in f if line.strip() != ""])
+        except FileNotFoundError:
+            return set()
+
+    def _write(self, unlocked):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp = tempfile.mkstemp(prefix=".gpacklock.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                for line in sorted(unlocked):
+                    f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp, 0o644)
+            os.replace(temp, self.path)
+        except BaseException:
+            os.remove(temp)
+            raise
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from core.util import trace
+from core.util.config import Config
+
+_mutex = threading.Lock()
+_loaded = {}  # path -> (stat key, Manifest)
+_partial = {}  # path -> (stat key, Manifest read up to a repo by find)
+
+REQUIRED = ["url", "local_dir", "branch"]
+REPO_KEYS = {  # repo entry key -> accepted value types
+    "url": (str,), "local_dir": (str,), "branch": (str,), "lock": (bool,),
+    "mirror": (bool, str), "untracked_cache": (bool,), "fsmonitor": (bool, str),
+    "depth": (int,), "filter": (str,), "single_branch": (bool,),
+    "shallow_submodules": (bool,), "submodule_jobs": (int,), "worktree": (bool, str),
+    "depends_on": (str, list)}
+CONFIG_KEYS = {  # config key -> accepted value types
+    "key": (bool, str), "lock": (bool,), "jobs": (int,), "host_jobs": (int,),
+    "mirror": (bool, str), "ls_remote": (bool,), "untracked_cache": (bool,),
+    "fsmonitor": (bool, str), "manifest_cache": (bool,), "depth": (int,),
+    "filter": (str,), "single_branch": (bool,), "shallow_submodules": (bool,),
+    "submodule_jobs": (int,), "worktree": (bool, str), "ssh_multiplex": (bool,),
+    "key_ttl": (int, float)}
+
+class Manifest(object):
+    def __init__(self, entries, name=None):
+        """Parsed GpackRepos file: config, repos in file order and a name index
+
+        entries yields (key, value, line) for every top level entry, see
+        read(). With name the manifest stops reading at that repo once the
+        config is known, it then only holds the repos read so far.
+        """
+        self.config = None
+        self.repos = []
+        self.index = {}
+        self.worktrees = set()  # (url, branch) of the repos checked out as worktrees
+        self.complete = False  # every entry was read
+        pending = []  # entries read before the config
+        for key, value, line in entries:
+            if key == "config":
+                if self.config != None:
+                    raise ValueError("line %d: config is given twice" % (line,))
+                validate("config", value or {}, line, CONFIG_KEYS)
+                self.config = Config(value or {})
+                for entry in pending:
+                    self.add(*entry)
+                pending = []
+            elif self.config == None:
+                pending.append((key, value, line))
+            else:
+                self.add(key, value, line)
+            if name != None and name in self.index and self.config != None:
+                return
+        if self.config == None:
+            self.config = Config({})
+        for entry in pending:
+            self.add(*entry)
+        self.complete = True
+        self.checkDependencies()
+
+    def add(self, key, value, line):
+        from core.repo import Repo  # core.repo imports core.util
+        validate(key, value, line, REPO_KEYS, REQUIRED)
+        repo = Repo(value, self.config)
+        if repo.worktree:
+            if (repo.url, repo.branch) in self.worktrees:
+                repo.worktree = None  # git checks a branch out once, clone it instead
+            else:
+                self.worktrees.add((repo.url, repo.branch))
+        self.repos.append(repo)
+        self.index.setdefault(repo.name, repo)  # first entry wins
+
+    def checkDependencies(self):
+        """Raises ValueError for unknown or circular depends_on entries"""
+        for repo in self.repos:
+            for name in repo.depends_on:
+                if name not in self.index:
+                    raise ValueError("%s depends on %s, which is not in GpackRepos"
+                        % (repo.name, name))
+        visiting, done = [], set()
+
+        def visit(repo):
+            if repo.name in done:
+                return
+            if repo.name in visiting:
+                cycle = visiting[visiting.index(repo.name):] + [repo.name]
+                raise ValueError("circular depends_on: %s" % (" -> ".join(cycle),))
+            visiting.append(repo.name)
+            for name in repo.depends_on:
+                visit(self.index[name])
+            visiting.pop()
+            done.add(repo.name)
+
+        for repo in self.repos:
+            visit(repo)
+
+def validate(name, data, line, schema, required=()):
+    """Raises ValueError if the entry data at line doesn't follow schema
+
+    Unknown keys are only reported, manifests may carry keys of other tools.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("line %d: %s must be a mapping of settings" % (line, name))
+    for key in required:
+        if data.get(key) == None:
+            raise ValueError("line %d: %s has no %s" % (line, name, key))
+    for key, value in data.items():
+        if key not in schema:
+            sys.stderr.write("gpack: GpackRepos line %d: unknown key %s in %s is ignored\n"
+                % (line, key, name))
+        elif value != None and type(value) not in schema[key]:
+            raise ValueError("line %d: %s of %s must be %s, not %r" % (line, key, name,
+                " or ".join(kind.__name__ for kind in schema[key]), value))
+    if isinstance(data.get("depends_on"), list) and \
+        not all(isinstance(item, str) for item in data["depends_on"]):
+        raise ValueError("line %d: depends_on of %s must be repo names" % (line, name))
+
+def statKey(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def load(path):
+    """Returns the Manifest of path, parsing it at most once per process
+
+    The file is parsed again only if its size or mtime changed. With
+    manifest_cache enabled in its config, the parsed entries are also kept in
+    a .<name>.cache file next to it, keyed by the file's SHA-1, so later runs
+    skip YAML parsing entirely.
+    """
+    key = statKey(path)
+    with _mutex:
+        if path in _loaded and _loaded[path][0] == key:
+            return _loaded[path][1]
+        with trace.span("parse manifest"):
+            manifest = Manifest(read(path))
+        _loaded[path] = (key, manifest)
+        return manifest
+
+def find(path, name):
+    """Returns the repo named name in the manifest of path, None if there is none
+
+    Reading stops at the repo, so commands working on one repo don't build
+    every entry of a large manifest. A manifest loaded in full is used as is.
+    """
+    key = statKey(path)
+    with _mutex:
+        for cache in (_loaded, _partial):
+            if path in cache and cache[path][0] == key and name in cache[path][1].index:
+                return cache[path][1].index[name]
+        with trace.span("parse manifest"):
+            manifest = Manifest(read(path), name)
+        if manifest.complete or name in manifest.index:
+            _partial[path] = (key, manifest)
+        return manifest.index.get(name)
+
+def config(path):
+    """Returns the config of the manifest of path, from find() if it was used"""
+    key = statKey(path)
+    with _mutex:
+        if path in _partial and _partial[path][0] == key:
+            return _partial[path][1].config
+    return load(path).config
+
+def read(path):
+    """Yields (key, value, line) for the top level entries of a manifest
+
+    Entries come from the cache file if it is valid. Otherwise the YAML
+    events are turned into one entry at a time, so no document tree of the
+    whole file is ever built, and a reader that stops early skips the rest
+    of the file.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    cache = cachePath(path)
+
+    try:
+        with open(cache, "r") as f:
+            cached = json.load(f)
+        if cached["sha1"] == digest:
+            for key, value, line in cached["entries"]:
+                yield key, value, line
+            return
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    records = []  # entries for the cache, until the config turns it off
+    for key, value, line in parse(content):
+        if key == "config" and records != None and not (value or {}).get("manifest_cache"):
+            records = None
+        elif records != None:
+            records.append((key, value, line))
+        yield key, value, line
+    if records != None and any(key == "config" for key, value, line in records):
+        writeCache(cache, digest, records)
+    elif os.path.isfile(cache):
+        try:
+            os.remove(cache)  # caching was turned off
+        except OSError:
+            pass
+
+def parse(content):
+    """Yields (key, value, line) for the top level entries of YAML content"""
+    import yaml  # a valid cache skips the import entirely
+    Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)  # libyaml when available
+    anchors = {}
+    try:
+        events = yaml.parse(content, Loader=Loader)
+        for event in events:
+            if isinstance(event, yaml.DocumentStartEvent):
+                break
+        else:
+            return  # empty file
+        event = next(events)
+        if isinstance(event, yaml.ScalarEvent) and scalar(event) == None:
+            return  # only comments
+        if not isinstance(event, yaml.MappingStartEvent):
+            raise ValueError("line %d: GpackRepos must be a mapping of repo entries"
+                % (event.start_mark.line + 1,))
+        for event in events:
+            if isinstance(event, yaml.MappingEndEvent):
+                return
+            key = node(events, event, anchors)
+            yield key, node(events, next(events), anchors), event.start_mark.line + 1
+    except yaml.YAMLError as e:
+        raise ValueError(str(e))
+
+def node(events, event, anchors):
+    """Returns the value of the YAML node starting at event"""
+    import yaml
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise ValueError("line %d: unknown alias *%s" % (event.start_mark.line + 1,
+                event.anchor))
+        return anchors[event.anchor]
+    if isinstance(event, yaml.ScalarEvent):
+        value = scalar(event)
+    elif isinstance(event, yaml.SequenceStartEvent):
+        value = []
+        for item in events:
+            if isinstance(item, yaml.SequenceEndEvent):
+                break
+            value.append(node(events, item, anchors))
+    else:
+        value, merged = {}, {}
+        for item in events:
+            if isinstance(item, yaml.MappingEndEvent):
+                break
+            key = node(events, item, anchors)
+            child = node(events, next(events), anchors)
+            if key == "<<":  # merge keys, explicit keys win
+                for source in (child if isinstance(child, list) else [child]):
+                    for name in source:
+                        merged.setdefault(name, source[name])
+            else:
+                try:
+                    value[key] = child
+                except TypeError:
+                    raise ValueError("line %d: keys must be scalars" %
+                        (item.start_mark.line + 1,))
+        for name in merged:
+            value.setdefault(name, merged[name])
+    if event.anchor != None:
+        anchors[event.anchor] = value
+    return value
+
+_resolver = None
+_constructor = None
+
+def scalar(event):
+    """Returns the Python value of a scalar event, as yaml.safe_load would"""
+    import yaml
+    global _resolver, _constructor
+    if _resolver == None:
+        _resolver = yaml.resolver.Resolver()
+        _constructor = yaml.constructor.SafeConstructor()
+    tag = event.tag
+    if tag == None or tag == "!":
+        tag = _resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+    if tag == "tag:yaml.org,2002:merge":
+        return "<<"
+    if tag == "tag:yaml.org,2002:str":
+        return event.value  # most scalars, no constructor needed
+    construct = _constructor.yaml_constructors.get(tag)
+    if construct == None:
+        raise ValueError("line %d: unsupported tag %s" % (event.start_mark.line + 1, tag))
+    return construct(_constructor, yaml.ScalarNode(tag, event.value))
+
+def cachePath(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, "." + name + ".cache")
+
+def writeCache(cache, digest, entries):
+    temp = "%s.%d.tmp" % (cache, os.getpid())
+    try:
+        with open(temp, "w") as f:
+            json.dump({"sha1": digest, "entries": entries}, f)
+        os.replace(temp, cache)
+    except (OSError, TypeError, ValueError):  # unwritable or not JSON data
+        if os.path.isfile(temp):
+            os.remove(temp)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import shutil
+import threading
+from core.util import command
+from core.util import trace
+
+MIRROR_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gpack", "mirrors")
+
+_mutex = threading.Lock()
+_url_locks = {}  # url -> lock held while its mirror is synced
+_synced = {}  # url -> mirror path (None if it failed) for this run
+
+def path(url, root=None):
+    """Returns the mirror directory for a remote url"""
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".git"
+    return os.path.join(root or MIRROR_DIR, name)
+
+def root(setting):
+    """Returns the mirror root for a manifest mirror setting, None if disabled"""
+    if setting == True:
+        return MIRROR_DIR
+    if setting:
+        return os.path.expanduser(str(setting))
+    return None
+
+@trace.traced("mirror sync")
+def sync(url, root=None):
+    """Creates or fetches the bare mirror of url, at most once per run
+
+    Returns the mirror path, or None if the mirror could not be synced so
+    the caller can fall back to a plain clone. The mirror never prunes or
+    garbage collects, clones borrowing its objects through alternates must
+    always find them.
+    """
+    with _mutex:
+        url_lock = _url_locks.setdefault(url, threading.Lock())
+    with url_lock:
+        if url in _synced:
+            return _synced[url]
+        mirror = path(url, root)
+        if os.path.isdir(mirror):
+            ok = command.run_all([["git", "fetch", "--quiet", "origin"]],
+                cwd=mirror)
+        else:
+            os.makedirs(os.path.dirname(mirror), exist_ok=True)
+            temp = "%s.%d.tmp" % (mirror, os.getpid())
+            ok = command.run_all([["git", "clone", "--quiet", "--mirror",
+                "-c", "gc.auto=0", "-c", "gc.pruneExpire=never", url, temp]])
+            if ok:
+                try:
+                    os.rename(temp, mirror)
+                except OSError:  # another gpack created it first
+                    shutil.rmtree(temp, ignore_errors=True)
+                    ok = os.path.isdir(mirror)
+        _synced[url] = mirror if ok else None
+        return _synced[url]
+
+def reference(repo):
+    """Returns the clone arguments that borrow objects from the repo mirror"""
+    if not repo.mirror:
+        return []
+    mirror = sync(repo.url, repo.mirror)
+    if mirror == None:
+        return []
+    return ["--reference", mirror]
+
+def redirect(repo):
+    """Returns the git arguments that fetch repo.url from the repo mirror
+
+    The mirror is synced first, so only the mirror talks to the remote.
+    Returns [] without a mirror, or if it could not be synced.
+    """
+    if not repo.mirror:
+        return []
+    mirror = sync(repo.url, repo.mirror)
+    if mirror == None:
+        return []
+    return ["-c", "url.%s.insteadOf=%s" % (os.path.abspath(mirror), repo.url)]
@@ -0,0 +1,86 @@
+import os
+import stat
+
+EXCLUDE = [".git"]  # never touch git metadata
+PARALLEL_DIRS = 64  # directories in one tree level before using threads
+
+def mode(st_mode, action):
+    """Returns st_mode with the owner write bit set by action"""
+    if action == "lock":
+        return st_mode & ~stat.S_IWUSR
+    return st_mode | stat.S_IWUSR
+
+def chmod(name, action, dir_fd=None):
+    """Applies action to name, returns True if its mode had to change"""
+    try:
+        st = os.stat(name, dir_fd=dir_fd)
+    except FileNotFoundError:  # removed while walking
+        return False
+    new = mode(st.st_mode, action)
+    if new == st.st_mode:
+        return False
+    try:
+        os.chmod(name, new, dir_fd=dir_fd)
+    except PermissionError:
+        return False
+    return True
+
+def applyDir(directory, action):
+    """Applies action to directory and its files, returns its subdirectories"""
+    subdirs = []
+    chmod(directory, action)
+    try:
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return subdirs
+    try:
+        with os.scandir(fd) as entries:
+            for entry in entries:
+                if entry.name in EXCLUDE or entry.is_symlink():
+                    continue  # chmod follows links, their targets may be outside
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(os.path.join(directory, entry.name))
+                else:
+                    chmod(entry.name, action, dir_fd=fd)
+    finally:
+        os.close(fd)
+    return subdirs
+
+def apply(directory, action, jobs=None):
+    """Applies a lock/unlock action to every file and directory of a tree
+
+    Files whose mode already matches are only stat'ed. The tree is walked
+    one level at a time, levels with many directories are spread across
+    jobs worker threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor  # only locking needs it
+    level = [directory]
+    with ThreadPoolExecutor(jobs) as executor:
+        while level:
+            if len(level) < PARALLEL_DIRS:
+                results = [applyDir(path, action) for path in level]
+            else:
+                results = executor.map(applyDir, level, [action] * len(level))
+            level = [subdir for subdirs in results for subdir in subdirs]
+
+def applyPaths(directory, paths, action):
+    """Applies action only to paths (relative to directory) and their parents
+
+    Directories in paths, such as submodules, are applied recursively.
+    """
+    parents = set()
+    for path in paths:
+        full = os.path.join(directory, path)
+        if os.path.islink(full):
+            pass  # chmod follows links, their targets may be outside
+        elif os.path.isdir(full):
+            apply(full, action)
+        else:
+            chmod(full, action)
+        parent = os.path.dirname(path)
+        while parent != "" and parent not in parents:
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+    for parent in parents:
+        chmod(os.path.join(directory, parent), action)
+    chmod(directory, action)
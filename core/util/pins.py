@@ -0,0 +1,47 @@
+import json
+import os
+
+NAME = "GpackRepos.lock"
+
+def path(root):
+    """Returns the lockfile path of a gpack root directory"""
+    return os.path.join(root, NAME)
+
+def read(path):
+    """Returns the pins of a lockfile as {repo name: pin}, {} if there is none
+
+    A pin holds the url and branch it was taken from, the commit SHA of the
+    repo and {submodule path: SHA} for every initialized submodule. Raises
+    ValueError when the file is not a lockfile.
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)  # JSONDecodeError is a ValueError
+    except FileNotFoundError:
+        return {}
+    repos = data.get("repos") if isinstance(data, dict) else None
+    if not isinstance(repos, dict) or not all(isinstance(pin, dict) and "sha" in pin
+        for pin in repos.values()):
+        raise ValueError("expected {\"repos\": {name: pin}}")
+    return repos
+
+def write(path, pins):
+    """Writes pins to a lockfile atomically, sorted so diffs stay small"""
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temp, "w") as f:
+            json.dump({"version": 1, "repos": pins}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(temp, path)
+    finally:
+        if os.path.isfile(temp):
+            os.remove(temp)
+
+def pin(repo, sha, submodules):
+    """Returns the pin of repo checked out at sha"""
+    return {"url": repo.url, "branch": repo.branch, "sha": sha,
+        "submodules": submodules}
+
+def stale(repo, pin):
+    """Checks if a pin was taken from a different url or branch than repo's"""
+    return pin.get("url") != repo.url or pin.get("branch") != repo.branch
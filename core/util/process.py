@@ -1,13 +1,113 @@
-from multiprocessing import Pool
-
-class ProccessPool():
-    def __init__(self, func, repos, allow=True):
-        """Creates a multiprocessing pool with given func and repos"""
-        if allow:
-            pool = Pool()
-            pool.map(func, repos)
-            pool.close()
-            pool.join()
-        else:  # if multiprocessing is not allowed, then iter each repo
-            for repo in repos:
-                func(repo)
\ No newline at end of file
+import time
+
+DEFAULT_JOBS = 32  # repos in flight at once
+DEFAULT_HOST_JOBS = 8  # repos in flight against a single remote host
+
+class ThreadPool():
+    def __init__(self, func, repos, jobs=None):
+        """Runs func over repos on a pool of threads
+
+        Repo operations spend their time waiting on git child processes, so
+        threads are enough to overlap them without forking a Python process
+        per repo. jobs limits the number of threads, results are kept in
+        self.results in repo order.
+        """
+        from concurrent.futures import ThreadPoolExecutor  # imports logging, keep it off startup
+        with ThreadPoolExecutor(jobs) as executor:
+            self.results = list(executor.map(func, repos))
+
+class AsyncPool():
+    def __init__(self, func, repos, jobs=None, host_jobs=None, failed=None,
+        blocked=None):
+        """Runs func over repos from an asyncio event loop
+
+        func may be a coroutine function, which is awaited directly, or a plain
+        function, which is run on a worker thread. At most jobs repos are in
+        flight at once and at most host_jobs of those talk to the same remote
+        host, results are kept in self.results in repo order.
+
+        Repos run as a DAG: a repo starts as soon as the repos of its
+        depends_on that are part of the run have finished. If failed(result)
+        is true for one of them, func is not run and blocked(repo, names of
+        the failed dependencies) gives its result instead. Start and end times
+        are kept in self.timings.
+        """
+        self.jobs = jobs or DEFAULT_JOBS
+        self.host_jobs = host_jobs or DEFAULT_HOST_JOBS
+        self.failed = failed or (lambda result: False)
+        self.blocked = blocked or (lambda repo, upstream: None)
+        self.timings = {}  # name -> (start, end)
+        import asyncio  # only the pools need it, keeps startup fast
+        self.results = asyncio.run(self.run(func, repos))
+
+    async def run(self, func, repos):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.jobs)
+        hosts = {}
+        finished = dict((repo.name, asyncio.Event()) for repo in repos)
+        failed = set()
+
+        async def job(repo, executor):
+            try:
+                for name in repo.depends_on:  # before taking any slot
+                    if name in finished:
+                        await finished[name].wait()
+                upstream = [name for name in repo.depends_on if name in failed]
+                if upstream:
+                    failed.add(repo.name)  # blocks its own dependents too
+                    return self.blocked(repo, upstream)
+                host = remote_host(repo.url)
+                if host not in hosts:
+                    hosts[host] = asyncio.Semaphore(self.host_jobs if host else self.jobs)
+                async with hosts[host]:  # wait on the host before taking a slot
+                    async with slots:
+                        start = time.time()
+                        if asyncio.iscoroutinefunction(func):
+                            result = await func(repo)
+                        else:
+                            result = await loop.run_in_executor(executor, func, repo)
+                        self.timings[repo.name] = (start, time.time())
+                if self.failed(result):
+                    failed.add(repo.name)
+                return result
+            except Exception:
+                failed.add(repo.name)
+                raise
+            finally:
+                finished[repo.name].set()
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(self.jobs) as executor:
+            return await asyncio.gather(*[job(repo, executor) for repo in repos])
+
+    def critical_path(self, repos):
+        """Returns the names of the dependency chain that finished last
+
+        Starting from the repo that finished last, each step goes to the
+        dependency that finished last, which is the one the repo waited on.
+        """
+        index = dict((repo.name, repo) for repo in repos)
+        if len(self.timings) == 0:
+            return []
+        name = max(self.timings, key=lambda name: self.timings[name][1])
+        path = [name]
+        while True:
+            upstream = [dependency for dependency in index[name].depends_on
+                if dependency in self.timings]
+            if len(upstream) == 0:
+                return path[::-1]
+            name = max(upstream, key=lambda name: self.timings[name][1])
+            path.append(name)
+
+def remote_host(url):
+    """Returns the host of a git remote url, "" for local remotes"""
+    if "://" in url:
+        scheme, rest = url.split("://", 1)
+        if scheme == "file":
+            return ""
+        host = rest.split("/", 1)[0].rsplit("@", 1)[-1]
+        return host.rsplit(":", 1)[0] if not host.endswith("]") else host
+    if ":" in url.split("/", 1)[0]:  # scp-like user@host:path
+        return url.split(":", 1)[0].rsplit("@", 1)[-1]
+    return ""
@@ -0,0 +1,104 @@
+import re
+import shutil
+import sys
+import threading
+import time
+
+# "Receiving objects:  45% (450/1000), 1.20 MiB | 2.40 MiB/s"
+PROGRESS = re.compile(r"^(?:remote: )?([A-Za-z ]+):\s+(\d+)%(?:.*\|\s*([\d.]+ \S+/s))?")
+REDRAW = 0.1  # seconds between redraws of the live view
+
+class Display(object):
+    def __init__(self, stream=None, tty=None):
+        """Live view of every running git job, one line per repo
+
+        On a terminal the lines are redrawn in place, anything else gets one
+        log line per phase change so pipes and CI logs stay readable.
+        """
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty() if tty == None else tty
+        self.jobs = {}  # name -> [phase, percent, rate], in start order
+        self._mutex = threading.Lock()
+        self._drawn = 0  # live lines currently on screen
+        self._last = 0
+
+    def start(self, name, phase="starting"):
+        with self._mutex:
+            self.jobs[name] = [phase, None, None]
+            self._log(name, phase)
+            self._draw(force=True)
+
+    def line(self, name, text):
+        """Feeds one line of git --progress output of a job"""
+        match = PROGRESS.match(text.strip())
+        if match == None:
+            return
+        phase, percent, rate = match.group(1), int(match.group(2)), match.group(3)
+        with self._mutex:
+            job = self.jobs.get(name)
+            if job == None:
+                return
+            if job[0] != phase:
+                self._log(name, phase)
+            job[:] = [phase, percent, rate or job[2]]
+            self._draw()
+
+    def finish(self, name, message=None):
+        with self._mutex:
+            self.jobs.pop(name, None)
+            self._clear()
+            if message != None:
+                self.stream.write(message + "\n")
+            self._draw(force=True)
+
+    def write(self, message):
+        """Prints message above the live view"""
+        with self._mutex:
+            self._clear()
+            self.stream.write(message + "\n")
+            self._draw(force=True)
+
+    def _log(self, name, phase):
+        if not self.tty:
+            self.stream.write("%s: %s\n" % (name, phase))
+            self.stream.flush()
+
+    def _clear(self):
+        if self.tty and self._drawn:
+            self.stream.write("\x1b[%dF\x1b[J" % (self._drawn,))  # up and erase
+            self._drawn = 0
+
+    def _draw(self, force=False):
+        if not self.tty or (not force and time.time() - self._last < REDRAW):
+            return
+        self._clear()
+        width = max([len(name) for name in self.jobs] + [0])
+        columns = shutil.get_terminal_size().columns - 1  # no wrapped lines
+        for name, (phase, percent, rate) in self.jobs.items():
+            line = "%-*s  %s" % (width, name, phase)
+            if percent != None:
+                line += " %3d%%" % (percent,)
+            if rate != None:
+                line += "  " + rate
+            self.stream.write(line[:columns] + "\n")
+        self._drawn = len(self.jobs)
+        self._last = time.time()
+        self.stream.flush()
+
+_display = None
+_display_mutex = threading.Lock()
+
+def display():
+    """Returns the process wide Display"""
+    global _display
+    with _display_mutex:
+        if _display == None:
+            _display = Display()
+        return _display
+
+def write(message):
+    """Prints message without breaking a live view"""
+    if _display == None:
+        print(message)
+    else:
+        _display.write(message)
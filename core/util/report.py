@@ -0,0 +1,78 @@
+import json
+
+INSTALLED = "installed"
+UPDATED = "updated"
+CURRENT = "already current"
+RINSED = "rinsed"
+RECLONED = "re-cloned"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"  # a repo it depends on failed
+
+class Result(object):
+    def __init__(self, name, status, elapsed):
+        """Outcome of a single repo operation"""
+        self.name = name
+        self.status = status
+        self.elapsed = elapsed
+
+def summary(results, title="Summary"):
+    """Prints one table of per-repo results followed by status totals"""
+    results = [result for result in results if result is not None]
+    if len(results) == 0:
+        return
+
+    width = max([len(result.name) for result in results] + [len("Repo")])
+    row = "%-" + str(width) + "s  %-15s  %8s"
+    print("\n%s" % (title,))
+    print(row % ("Repo", "Status", "Time"))
+    print(row % ("-" * width, "-" * 15, "-" * 8))
+    for result in results:
+        print(row % (result.name, result.status, "%.1fs" % (result.elapsed,)))
+
+    totals = {}
+    for result in results:
+        totals[result.status] = totals.get(result.status, 0) + 1
+    order = [INSTALLED, UPDATED, CURRENT, RINSED, RECLONED, SKIPPED, FAILED, BLOCKED]
+    print("\n" + ", ".join(["%d %s" % (totals[status], status)
+        for status in order if status in totals]))
+
+def criticalPath(pool, repos):
+    """Prints the chain of dependent repos that bounded the run of pool"""
+    path = pool.critical_path(repos)
+    if len(path) < 2:  # no dependency waited on
+        return
+    steps = ["%s %.1fs" % (name, pool.timings[name][1] - pool.timings[name][0])
+        for name in path]
+    total = pool.timings[path[-1]][1] - pool.timings[path[0]][0]
+    print("\nCritical path: %s (%.1fs)" % (" -> ".join(steps), total))
+
+def checks(states, as_json=False):
+    """Prints the workspace states of git.check as a table or as JSON"""
+    if as_json:
+        print(json.dumps(states, indent=2))
+        return
+    if len(states) == 0:
+        return
+
+    width = max([len(state["name"]) for state in states] + [len("Repo")])
+    row = "%-" + str(width) + "s  %-4s  %-20s  %-9s  %-13s  %-10s  %s"
+    print(row % ("Repo", "OK", "Branch", "Changes", "Ahead/Behind", "Lock", "Submodules"))
+    print(row % ("-" * width, "-" * 4, "-" * 20, "-" * 9, "-" * 13, "-" * 10, "-" * 10))
+    for state in states:
+        if not state["present"]:
+            print(row % (state["name"], "no", "not installed", "", "", "", ""))
+            continue
+        branch = state["branch"] or "?"
+        if branch != state["expected_branch"]:
+            branch += " (%s)" % (state["expected_branch"],)
+        ahead_behind = "?" if state["ahead"] == None else \
+            "+%d -%d" % (state["ahead"], state["behind"])
+        lock = "locked" if state["locked"] else "unlocked"
+        if state["locked"] != state["expected_locked"]:
+            lock += "!"  # disagrees with .gpacklock
+        print(row % (state["name"], "yes" if state["ok"] else "no", branch,
+            state["changes"] or "clean", ahead_behind, lock,
+            ", ".join(state["submodules"]) or "-"))
+        if state["error"] != None:
+            print("%s  %s" % (" " * width, state["error"]))
@@ -1,51 +1,204 @@
-import subprocess
-import requests
+import hashlib
+import json
 import os
+import shlex
+import shutil
+import subprocess
 import sys
-import yaml
-from core.util.config import Config
+import tempfile
+import threading
+import time
+from core.util import manifest as gpack_manifest
+from core.util import trace
+
+KEY_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gpack", "keys")
+KEY_TTL = 24 * 60 * 60  # seconds a cached key is used before downloading it again
+CONTROL_PERSIST = 600  # seconds a master outlives a gpack run that died
 
+_mutex = threading.Lock()
+_base = None  # ssh command of the user, GIT_SSH_COMMAND or GIT_SSH
+_key_file = None  # key given to every ssh, set by download_key
+_control_dir = None  # ControlPath directory of this run, set by multiplex
+_masters = []  # destinations with a master started by this run
+
+@trace.traced("download key")
 def download_key(ROOT_DIR):
-    """Downloads a new key from a remote server"""
-    key_url = ""
-    os.chdir(ROOT_DIR)
-    if not os.path.isfile("GpackRepos"):
-        with open("GpackRepos", "w") as f:
-            print("No GpackRepos file found, creating one...")
-            print("Add repos with ./gpack add [url] [dir] [branch]")
-
-    data = yaml.load(open("GpackRepos"))
-
-    found_config = False
-    for key, value in data.items():
-        if key == "config":
-            found_config = True
-            config = Config(value)
-
-    if found_config:
-        key_url = config.key
-    else:
-        key_url = False
+    """Points git at the ssh key of the GpackRepos config
 
-    if key_url != False:
-        try:
-            r = requests.get(key_url)
-        except Exception:
-            print("Key Error: Check GpackRepos for ssh_key")
-            sys.exit()
-
-        with open(".temp_ssh_key", "w") as f:
-            f.write(r.content.decode("utf-8"))  # convert bytes like string to utf-8
-        os.chmod(".temp_ssh_key", 0o600)  # read + write
-        ssh = ["ssh", "-i", ".temp_ssh_key"]
+    Only commands that talk to remotes call this. The key is downloaded at
+    most once per key_ttl seconds (config, a day by default) into a cache
+    checked against its SHA-256, and handed to every git child process
+    through GIT_SSH_COMMAND.
+    """
+    config = gpack_manifest.config(os.path.join(ROOT_DIR, "GpackRepos"))
+    if config.key == False:
+        return
+    with _mutex:
+        global _key_file
+        _key_file = cached_key(config.key, config.key_ttl or KEY_TTL)
+        if _key_file == None:
+            _key_file = fetch_key(config.key)
+        set_command()
+
+def base_command():
+    """Returns the ssh command git would use without gpack"""
+    global _base
+    if _base == None:
+        if os.environ.get("GIT_SSH_COMMAND"):
+            _base = os.environ["GIT_SSH_COMMAND"]
+        elif os.environ.get("GIT_SSH"):
+            _base = shlex.quote(os.environ["GIT_SSH"])
+        else:
+            _base = "ssh"
+    return _base
+
+def options():
+    """Returns the ssh options for the key and the shared connections
+
+    The key is offered in addition to the agent and ~/.ssh keys of the user,
+    hosts that don't accept it still get those.
+    """
+    args = []
+    if _key_file != None:
+        args += ["-i", _key_file]
+    if _control_dir != None:
+        args += ["-o", "ControlMaster=auto", "-o",
+            "ControlPath=%s" % (os.path.join(_control_dir, "%C"),), "-o",
+            "ControlPersist=%d" % (CONTROL_PERSIST,)]
+    return args
+
+def set_command():
+    """Points GIT_SSH_COMMAND of git child processes at options()"""
+    os.environ["GIT_SSH_COMMAND"] = " ".join([base_command()] +
+        [shlex.quote(arg) for arg in options()])
+
+def destination(url):
+    """Returns (user@host, port or None) of an ssh remote url, None otherwise"""
+    if "://" in url:
+        scheme, rest = url.split("://", 1)
+        if scheme not in ("ssh", "git+ssh", "ssh+git"):
+            return None
+        host = rest.split("/", 1)[0]
+        if host.endswith("]") or ":" not in host.rsplit("@", 1)[-1]:
+            return host, None
+        host, port = host.rsplit(":", 1)
+        return host, port
+    if ":" in url.split("/", 1)[0]:  # scp-like user@host:path
+        return url.split(":", 1)[0], None
+    return None
+
+def ssh_args(target, *args):
+    """Returns the argv of an ssh call to a (user@host, port) destination"""
+    port = ["-p", target[1]] if target[1] else []
+    return shlex.split(base_command()) + list(args) + options() + port + [target[0]]  # first -o wins
+
+@trace.traced("ssh masters")
+def multiplex(repos):
+    """Shares one ssh connection per remote host for the rest of the run
+
+    Every git ssh session goes through a ControlMaster in a private
+    directory, a master is started for each host up front so the repos
+    don't race to create it. Masters are stopped by remove_key.
+    """
+    global _control_dir
+    targets = sorted(set([target for target in map(destination,
+        [repo.url for repo in repos]) if target != None]))
+    if len(targets) == 0 or _control_dir != None:
+        return
+    _control_dir = tempfile.mkdtemp(prefix="gpack-ssh-")  # short, sun_path is 108 bytes
+    set_command()
+    from core.util.process import ThreadPool
+    ThreadPool(start_master, targets, len(targets))
+
+def start_master(target):
+    """Starts the background master of a destination, returns success"""
+    args = ssh_args(target, "-o", "ControlMaster=yes", "-o", "BatchMode=yes",
+        "-f", "-N")
+    try:  # -f keeps stdout open in the background, don't wait on it
+        ok = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, timeout=30).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        ok = False
+    if ok:
+        with _mutex:
+            _masters.append(target)
+    return ok  # without a master git still connects, just not shared
+
+def stop_masters():
+    """Stops the masters of this run and removes their directory"""
+    global _control_dir
+    for target in _masters:
         try:
-            subprocess.check_output(ssh, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            print(e.output.decode("utf-8").replace("fatal", "gpack").strip())
+            subprocess.run(ssh_args(target, "-O", "exit"), stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+    del _masters[:]
+    if _control_dir != None:
+        shutil.rmtree(_control_dir, ignore_errors=True)
+        _control_dir = None
+
+def key_path(key_url):
+    """Returns the cache file of the key downloaded from key_url"""
+    return os.path.join(KEY_DIR, hashlib.sha1(key_url.encode("utf-8")).hexdigest())
+
+def cached_key(key_url, ttl=None):
+    """Returns the cached key file of key_url, None if missing, changed or older than ttl"""
+    key_file = key_path(key_url)
+    try:
+        with open(key_file + ".json", "r") as f:
+            meta = json.load(f)
+        with open(key_file, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != key_url or meta.get("sha256") != digest:
+        return None
+    if ttl != None and time.time() - meta.get("time", 0) > ttl:
+        return None
+    return key_file
+
+def fetch_key(key_url):
+    """Downloads the key of key_url into the cache, returns its file
+
+    An expired but intact cached key is still used, however old, when the
+    key server can't be reached. It stays in KEY_DIR until a download
+    replaces it or it is deleted by hand.
+    """
+    import requests  # only commands talking to remotes pay for the import
+    try:
+        r = requests.get(key_url, timeout=30)
+        r.raise_for_status()
+    except Exception:
+        key_file = cached_key(key_url)
+        if key_file != None:
+            print("Key Warning: %s is unreachable, using the cached key" % (key_url,))
+            return key_file
+        print("Key Error: Check GpackRepos for ssh_key")
+        sys.exit()
+
+    key_file = key_path(key_url)
+    os.makedirs(KEY_DIR, mode=0o700, exist_ok=True)
+    write(key_file, r.content)
+    meta = {"url": key_url, "sha256": hashlib.sha256(r.content).hexdigest(),
+        "time": time.time()}
+    write(key_file + ".json", json.dumps(meta).encode("utf-8"))
+    return key_file
+
+def write(path, content):
+    """Atomically writes content to a file only the owner can read"""
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)  # read + write
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(temp, path)
 
 def remove_key(ROOT_DIR):
-    os.chdir(ROOT_DIR)
-    if os.path.isfile(".temp_ssh_key"):
-        os.remove(".temp_ssh_key")
+    """Stops the ssh masters of the run and removes the per-run key file
+    older gpack versions left in ROOT_DIR"""
+    stop_masters()
+    key_file = os.path.join(ROOT_DIR, ".temp_ssh_key")
+    if os.path.isfile(key_file):
+        os.remove(key_file)
     else:
         return
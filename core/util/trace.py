@@ -0,0 +1,108 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+CO_COROUTINE = 0x80  # inspect.CO_COROUTINE, inspect is slow to import
+
+_enabled = False
+_events = []  # Chrome trace "complete" events
+_mutex = threading.Lock()
+_repo = contextvars.ContextVar("gpack_trace_repo", default=None)
+_start = time.time()
+
+def enable():
+    """Starts recording spans for this process"""
+    global _enabled
+    _enabled = True
+
+def enabled():
+    return _enabled
+
+def _record(name, category, start, elapsed, args):
+    event = {"name": name, "cat": category, "ph": "X",
+        "ts": int((start - _start) * 1e6), "dur": int(elapsed * 1e6),
+        "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+    with _mutex:
+        _events.append(event)
+
+@contextlib.contextmanager
+def span(name, repo=None):
+    """Records a gpack phase, commands run inside it are tagged with repo"""
+    if not _enabled:
+        yield
+        return
+    token = _repo.set(repo or _repo.get())
+    start = time.time()
+    try:
+        yield
+    finally:
+        _record(name, "gpack", start, time.time() - start, {"repo": _repo.get()})
+        _repo.reset(token)
+
+def traced(name):
+    """Decorator recording every call of a repo function as a span
+
+    The repo name is taken from the first argument when it is a Repo.
+    """
+    def decorate(func):
+        def repo_name(args):
+            if args and hasattr(args[0], "name") and hasattr(args[0], "url"):
+                return args[0].name
+            return None
+
+        if func.__code__.co_flags & CO_COROUTINE:  # async def
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(name, repo_name(args)):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(name, repo_name(args)):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def command(args, cwd, start, elapsed, returncode, size):
+    """Records a finished child process"""
+    if not _enabled:
+        return
+    _record(label(args), "command", start, elapsed, {"repo": _repo.get(),
+        "argv": list(args), "cwd": cwd, "exit": returncode, "bytes": size})
+
+def label(args):
+    """Returns the program and subcommand of argv, such as git status"""
+    words = [args[0]]
+    skip = False
+    for arg in args[1:]:
+        if skip:
+            skip = False
+        elif arg in ("-c", "-C"):  # options taking a value
+            skip = True
+        elif not arg.startswith("-"):
+            words.append(arg)
+            break
+    return " ".join(words)
+
+def export(path):
+    """Writes all recorded spans as a Chrome trace-event file"""
+    with _mutex:
+        events = sorted(_events, key=lambda event: event["ts"])
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+def summary(count=10):
+    """Prints the count slowest recorded operations"""
+    with _mutex:
+        events = sorted(_events, key=lambda event: -event["dur"])[:count]
+    if len(events) == 0:
+        return
+    print("\nSlowest operations")
+    for event in events:
+        detail = " ".join(event["args"].get("argv", [])) or event["name"]
+        print("%9.3fs  %-15s %s" % (event["dur"] / 1e6,
+            event["args"].get("repo") or "-", detail))
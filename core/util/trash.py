@@ -0,0 +1,71 @@
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+from core.util import perms
+from core.util.process import ThreadPool
+
+TRASH_DIR = ".gpack-trash"  # trees waiting to be deleted, in the gpack root
+JOBS = 8  # trees deleted at once
+
+_counter = itertools.count()
+
+def path(root):
+    """Returns the trash directory of a gpack root"""
+    return os.path.join(root, TRASH_DIR)
+
+def move(directory, root):
+    """Renames directory into the trash of root, returns its new path
+
+    Returns None if it can't be renamed there, such as from another file
+    system.
+    """
+    trash = path(root)
+    os.makedirs(trash, exist_ok=True)
+    target = os.path.join(trash, "%s.%d.%d" % (os.path.basename(directory),
+        os.getpid(), next(_counter)))
+    perms.chmod(directory, "unlock")  # moving a directory rewrites its ..
+    try:
+        os.rename(directory, target)
+    except OSError:
+        return None
+    return target
+
+def delete(directory):
+    """Deletes a tree, locked or not
+
+    Unlinking only needs write access to the parent directory, so write
+    access is restored on directories in one pass and files are left alone.
+    """
+    for parent, dirs, files in os.walk(directory):
+        perms.chmod(parent, "unlock")
+    shutil.rmtree(directory, ignore_errors=True)
+
+def discard(directory, root):
+    """Moves directory to the trash of root, deletes it right away if it can't"""
+    if move(directory, root) == None:
+        delete(directory)
+
+def empty(root, jobs=JOBS):
+    """Deletes every tree in the trash of root in parallel"""
+    trash = path(root)
+    try:
+        names = os.listdir(trash)
+    except FileNotFoundError:
+        return
+    ThreadPool(delete, [os.path.join(trash, name) for name in names], jobs)
+    try:
+        os.rmdir(trash)
+    except OSError:  # trashed by another gpack meanwhile
+        pass
+
+def emptyInBackground(root):
+    """Empties the trash of root from a detached process that outlives gpack"""
+    if not os.path.isdir(path(root)):
+        return
+    package = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    code = "import sys; sys.path.insert(0, %r); from core.util import trash; trash.empty(%r)" % \
+        (package, root)
+    subprocess.Popen([sys.executable, "-c", code], cwd=root, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import shutil
+import threading
+from core.util import command
+from core.util import mirror
+from core.util import trace
+from core.util import trash
+
+WORKTREE_DIR = ".gpack-worktrees"  # shared clones, in the gpack root
+
+_mutex = threading.Lock()
+_url_locks = {}  # url -> lock held while its shared clone is synced or changed
+_synced = {}  # url -> shared clone path (None if it failed) for this run
+
+def path(url, root):
+    """Returns the shared clone directory for a remote url"""
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".git"
+    return os.path.join(root, name)
+
+def root(setting, directory):
+    """Returns the shared clone root for a manifest worktree setting, None if disabled"""
+    if setting == True:
+        return os.path.join(directory, WORKTREE_DIR)
+    if setting:
+        return os.path.join(directory, os.path.expanduser(str(setting)))
+    return None
+
+def url_lock(url):
+    with _mutex:
+        return _url_locks.setdefault(url, threading.Lock())
+
+@trace.traced("worktree sync")
+def sync(repo):
+    """Creates or fetches the shared clone of repo.url, at most once per run
+
+    The shared clone is bare with origin/* remote-tracking refs, so one fetch
+    brings the branch of every worktree of the url up to date. Returns the
+    shared clone path, or None if it could not be created.
+    """
+    with url_lock(repo.url):
+        if repo.url in _synced:
+            return _synced[repo.url]
+        shared = path(repo.url, repo.worktree)
+        fetch = ["git"] + mirror.redirect(repo) + ["fetch", "--quiet", "--prune", "origin"]
+        if os.path.isdir(shared):
+            ok = command.run_all([fetch], cwd=shared)
+        else:
+            os.makedirs(repo.worktree, exist_ok=True)
+            temp = "%s.%d.tmp" % (shared, os.getpid())
+            clone = ["git", "clone", "--quiet", "--bare"] + mirror.reference(repo)
+            if repo.filter:
+                clone += ["--filter=%s" % (repo.filter,)]
+            refspec = ["git", "config", "remote.origin.fetch",
+                "+refs/heads/*:refs/remotes/origin/*"]  # bare clones have none
+            ok = command.run_all([clone + [repo.url, temp]]) and \
+                command.run_all([refspec, fetch], cwd=temp)
+            if ok:
+                try:
+                    os.rename(temp, shared)
+                except OSError:  # another gpack created it first
+                    ok = os.path.isdir(shared)
+            shutil.rmtree(temp, ignore_errors=True)
+        _synced[repo.url] = shared if ok else None
+        return _synced[repo.url]
+
+def add(repo):
+    """Checks out repo.branch at repo.directory as a worktree of the shared clone
+
+    Worktrees of one url are added one at a time, they write to the same
+    git directory. The branch gets no upstream, it is merged from
+    origin/<branch> explicitly. Returns success.
+    """
+    shared = sync(repo)
+    if shared == None:
+        return False
+    prune = ["git", "worktree", "prune"]  # forget worktrees deleted by hand
+    add = ["git", "worktree", "add", "--quiet", "--no-track", "-B", repo.branch,
+        repo.directory, "origin/" + repo.branch]
+    with url_lock(repo.url):
+        return command.run_all([prune, add], cwd=shared)
+
+def remove(repo, root):
+    """Moves the worktree of repo to the trash of root
+
+    The shared clone forgets the worktree and goes to the trash as well
+    with its last worktree.
+    """
+    shared = path(repo.url, repo.worktree)
+    with url_lock(repo.url):
+        trash.discard(repo.directory, root)
+        if not os.path.isdir(shared):
+            return
+        command.run(["git", "worktree", "prune"], cwd=shared)
+        listing = command.run(["git", "worktree", "list", "--porcelain"], cwd=shared)
+        if listing.ok and listing.output.count("worktree ") <= 1:  # only the bare clone
+            trash.discard(shared, root)
+            _synced.pop(repo.url, None)
@@ -1,44 +1,75 @@
 import os
 import sys
-import shutil
 import threading
-import stat
-import traceback
-import yaml
 
+if __name__ == "__main__":  # core.util.git imports gpack, share this module with it
+    sys.modules.setdefault("gpack", sys.modules[__name__])
+import time
+
+from core.util import daemon
 from core.util import git
 from core.util import ssh
-from core.util.config import Config
-from core.util.process import ProccessPool
-from core.repo import Repo
+from core.util import manifest
+from core.util import perms
+from core.util import pins
+from core.util import progress
+from core.util import report
+from core.util import trace
+from core.util import trash
+from core.util import worktree
+from core.util.lockstate import LockState
+from core.util.process import AsyncPool
 
 ROOT_DIR = os.getcwd()  # saves root dir for clio-template
-
-def install(args):
-    os.chdir(ROOT_DIR)
+REMOTE_COMMANDS = ["install", "update", "purge", "push", "tag", "checkout", "clean",
+    "check"]
+SINGLE_COMMANDS = ["push", "tag", "checkout"]  # always given exactly one repo
+LOCK_FILE = os.path.join(ROOT_DIR, ".gpacklock")
+_lock_state = None  # LockState loaded on first use
+_lock_state_mutex = threading.Lock()
+
+def install(args, jobs=None, frozen=False):
     for repo in getRepos():
         if not os.path.isdir(repo.dirname):
-            os.mkdir(repo.dirname)
+            os.makedirs(repo.dirname)
 
-    if len(args) == 0:
-        ProccessPool(vinstallRepo, getRepos())  # multiprocessing pool
+    if frozen:
+        if len(args) > 1 or (len(args) == 1 and args[0] != "-nogui"):
+            help()
+        current = getPins()  # read once, not once per repo
+        pool = runPool(lambda repo: frozenRepo(repo, current), getRepos(), jobs)
+        report.summary(pool.results, "Install summary")
+    elif len(args) == 0:
+        pool = runPool(vinstallRepo, getRepos(), jobs)
     elif args[0] == "-nogui":
-        ProccessPool(installRepo, getRepos())  # multiprocessing pool
+        pool = runPool(installRepoAsync, getRepos(), jobs)
     else:
         help()
+    report.criticalPath(pool, getRepos())
 
+@trace.traced("install")
 def vinstallRepo(repo):
-    """verbose repo install"""
+    """verbose repo install, returns a report.Result"""
+    start = time.time()
+    status = report.CURRENT
     if not os.path.isdir(repo.directory):  # don't try and clone existing directory
-        repo.clone(verbose=True)
+        status = report.INSTALLED if repo.clone(verbose=True) else report.FAILED
         if repo.lock == True:
             lock(repo)
+    return report.Result(repo.name, status, time.time() - start)
 
-def installRepo(repo):
+@trace.traced("install")
+async def installRepoAsync(repo):
+    """Quiet repo install for AsyncPool, the clone runs as an asyncio child process"""
+    start = time.time()
+    status = report.CURRENT
     if not os.path.isdir(repo.directory):  # don't try and clone existing directory
-        repo.clone()
+        status = report.INSTALLED if await repo.clone_async() else report.FAILED
         if repo.lock == True:
-            lock(repo)
+            import asyncio
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lock, repo)  # chmod walk off the loop
+    return report.Result(repo.name, status, time.time() - start)
 
 def tagRepo(repo):
     print("Available tags for %s: " % (repo.name,))
@@ -58,54 +89,171 @@ def checkout(repo):
         print("%s does not exist, try running ./gpack install" % (repo.name,))
 
 def uninstall():
-    for repo in getRepos():
-        repoUninstall(repo)
-
-def repoUninstall(repo):
-    """Uninstalls a specific repository"""
-    if os.path.isdir(repo.directory):
-        unlock(repo)
-        shutil.rmtree(repo.dirname+"/"+getFile(repo))
+    """Uninstalls every repo, their trees are deleted in the background"""
+    with lockState().batch():
+        for repo in getRepos():
+            repoUninstall(repo, background=False)
+    trash.emptyInBackground(ROOT_DIR)
 
-def getFile(repo):
-    for file in os.listdir(repo.dirname):
-        if file == repo.name:
-            return file
+@trace.traced("uninstall")
+def repoUninstall(repo, background=True):
+    """Uninstalls a specific repository
 
-def check():
-    git.check(getRepos())
+    The tree is renamed into the trash, which a detached process empties
+    unless background is False.
+    """
+    if os.path.isdir(repo.directory):
+        lockState().add(repo.directory)
+        if repo.worktree:
+            worktree.remove(repo, ROOT_DIR)  # also drops its git directory in the shared clone
+        else:
+            trash.discard(repo.directory, ROOT_DIR)
+        if background:
+            trash.emptyInBackground(ROOT_DIR)
+
+def check(args, jobs=None):
+    """Checks every repo concurrently, exits with 1 if any is not as GpackRepos says
+
+    An offline check is answered by the daemon when one is running.
+    """
+    offline, args = parseFlag(args, "--offline")
+    as_json, args = parseFlag(args, "--json")
+    if len(args) > 1:
+        help()
+    answer = None
+    if offline:
+        answer = daemon.query(ROOT_DIR, {"request": "check",
+            "repo": args[0] if args else None})
+    if answer != None and "states" in answer:
+        states = [daemon.checkState(state) for state in answer["states"]]
+    else:
+        repos = getRepos() if len(args) == 0 else [getRepo(args[0])]
+        states = runPool(lambda repo: git.check(repo, offline), repos, jobs).results
+    report.checks(states, as_json)
+    if not all([state["ok"] for state in states]):
+        ssh.remove_key(ROOT_DIR)
+        sys.exit(1)
 
-def clean():
+def clean(jobs=None):
     """Cleans all repos"""
-    ProccessPool(cleanRepo, getRepos())
+    pool = runPool(cleanRepo, getRepos(), jobs)
+    report.criticalPath(pool, getRepos())
 
+@trace.traced("clean")
 def cleanRepo(repo):
-    """Cleans a repo of unstaged work"""
+    """Cleans a repo of unstaged work, returns a report.Result"""
+    start = time.time()
     if os.path.isdir(repo.directory):
-        with open(ROOT_DIR + "/.gpacklock", "r") as f:
-            if repo.directory not in [line.strip() for line in f.readlines()]:
-                unlock(repo)
-        repo.clean()
+        locked = repo.lock != False and repo.directory not in lockState()
+        ok = repo.clean(locked)  # only the cleaned paths are unlocked and re-locked
+        status = report.RINSED if ok else report.FAILED
     else:
-        print("%s does not exist, try running ./gpack install" % (repo.name,))
-
-def update():
-    for repo in getRepos():
-        updateRepo(repo)
-
+        progress.write("%s does not exist, try running ./gpack install" % (repo.name,))
+        status = report.FAILED
+    return report.Result(repo.name, status, time.time() - start)
+
+def update(jobs=None, frozen=False):
+    """Updates all repos in parallel and prints a summary of the results"""
+    repos = getRepos()
+    if frozen:
+        current = getPins()  # read once, not once per repo
+        pool = runPool(lambda repo: frozenRepo(repo, current), repos, jobs)
+        report.summary(pool.results, "Update summary")
+        report.criticalPath(pool, repos)
+        return
+    results = {}
+    config = getConfig()
+    if config.ls_remote:  # repos at the remote tip skip fetch
+        git.remoteHeads(repos, jobs or config.jobs, config.host_jobs)
+        answer = daemon.query(ROOT_DIR, {"request": "check"}) or {}
+        for state in answer.get("states", []):  # clean, locked and at the tip
+            repo = getManifest().index.get(state["name"])
+            if repo == None:  # the daemon still has an older GpackRepos
+                continue
+            if state["ok"] and state["head"] == repo.remote_sha:
+                results[repo.name] = report.Result(repo.name, report.CURRENT, 0.0)
+    pool = runPool(updateRepo, [repo for repo in repos if repo.name not in results], jobs)
+    for result in pool.results:
+        results[result.name] = result
+    report.summary([results[repo.name] for repo in repos if repo.name in results],
+        "Update summary")
+    report.criticalPath(pool, repos)
+    trash.emptyInBackground(ROOT_DIR)  # trees of re-cloned repos
+
+@trace.traced("updateRepo")
 def updateRepo(repo):
-    """Helper method for update"""
-    if not os.path.isdir(repo.directory):
-        print("Error: %s doesn't exist, cloning instead" % (repo.name,))
-        repo.clone()
-        lock(repo)
-    elif repo.update() == False:
-        try:
-            shutil.rmtree(repo.directory)
-        except FileNotFoundError:
-            pass
-        repo.clone()
-        lock(repo)
+    """Helper method for update, returns a report.Result for the repo"""
+    start = time.time()
+    try:
+        if not os.path.isdir(repo.directory):
+            progress.write("Error: %s doesn't exist, cloning instead" % (repo.name,))
+            status = report.RECLONED if repo.clone() else report.FAILED
+            lock(repo)
+        else:
+            status = repo.update()
+            if status == False:
+                if os.path.isdir(repo.directory):
+                    trash.discard(repo.directory, ROOT_DIR)  # emptied after the run
+                status = report.RECLONED if repo.clone() else report.FAILED
+                lock(repo)
+    except Exception as e:
+        progress.write("gpack: updating %s failed: %s" % (repo.name, e))
+        status = report.FAILED
+    return report.Result(repo.name, status, time.time() - start)
+
+@trace.traced("frozenRepo")
+def frozenRepo(repo, current):
+    """Moves a repo to its commits in the lockfile, returns a report.Result
+
+    current are the pins of the lockfile. Repos already at their pinned
+    commits are skipped without any network access, missing repos are
+    cloned first.
+    """
+    start = time.time()
+    pin = current.get(repo.name)
+    try:
+        if pin == None or pins.stale(repo, pin):
+            progress.write("gpack: %s has no pin for its url and branch in %s, "
+                "try running ./gpack pin" % (repo.name, pins.NAME))
+            status = report.FAILED
+        elif os.path.isdir(repo.directory) and git.pinned(repo, pin):
+            status = report.CURRENT
+        elif not os.path.isdir(repo.directory):
+            if not repo.clone():
+                return report.Result(repo.name, report.FAILED, time.time() - start)
+            status = git.frozen(repo, pin)
+            if repo.lock == True:
+                lock(repo)
+            else:
+                applyPerms(repo, "unlock")
+            if status == report.UPDATED:
+                status = report.RECLONED
+        else:
+            status = git.frozen(repo, pin)
+    except Exception as e:
+        progress.write("gpack: updating %s failed: %s" % (repo.name, e))
+        status = report.FAILED
+    return report.Result(repo.name, status, time.time() - start)
+
+def pin(repos):
+    """Writes the checked out commits of repos to the lockfile"""
+    current = dict(getPins())
+    for repo in repos:
+        if not os.path.isdir(repo.directory):
+            progress.write("%s does not exist, try running ./gpack install" % (repo.name,))
+            continue
+        current[repo.name] = git.pin(repo)
+    names = set(repo.name for repo in getRepos())
+    pins.write(pins.path(ROOT_DIR), dict((name, value)
+        for name, value in current.items() if name in names and value != None))
+
+def getPins():
+    """Returns the pins of the lockfile, {} if there is none, exits if it is invalid"""
+    try:
+        return pins.read(pins.path(ROOT_DIR))
+    except ValueError as e:  # not JSON or not a lockfile
+        print("gpack: %s: %s" % (pins.NAME, e))
+        sys.exit(1)
 
 def pushRepo(repo):
     """Pushes local changes"""
@@ -113,166 +261,186 @@ def pushRepo(repo):
 
 def addRepo(args):
     """Adds repo to GpackRepos file"""
+    import yaml
     args = [str(arg) for arg in args]
     data = {"name": {"url":args[0], "local_dir":args[1], "branch":args[2]}}
-    with open("./GpackRepos", "a") as f:  # append repo to GpackRepos
+    with open(os.path.join(ROOT_DIR, "GpackRepos"), "a") as f:  # append repo to GpackRepos
         f.write("\n")
         yaml.dump(data, f, default_flow_style=False)
 
 def list():
     """Prints all repo names in GpackRepos"""
-    for repo in getRepos():
-        print(repo.name)
+    answer = daemon.query(ROOT_DIR, {"request": "list"})
+    names = (answer or {}).get("names")
+    if names == None:  # no daemon, or it could not answer
+        names = [repo.name for repo in getRepos()]
+    for name in names:
+        print(name)
 
 def purge():
-    """Full uninstall and install of ALL repos in GpackRepos"""
+    """Full uninstall and install of ALL repos in GpackRepos
+
+    Cloning starts as soon as the old trees are in the trash.
+    """
     uninstall()
     install([])
 
-def checkBranch(repo):
+def checkBranch(name):
     """Prints the current branch of input repo"""
+    answer = daemon.query(ROOT_DIR, {"request": "branch", "repo": name})
+    if answer != None and answer.get("branches", {}).get(name) != None:
+        print("'%s' is currently on branch '%s'" % (name, answer["branches"][name]))
+        return
+    repo = getRepo(name)
     if os.path.isdir(repo.directory):
         repo.checkBranch()
     else:
         print("%s does not exist, try running ./gpack install" % (repo.name,))
 
+def createManifest():
+    """Creates an empty GpackRepos file if there is none"""
+    path = os.path.join(ROOT_DIR, "GpackRepos")
+    if not os.path.isfile(path):
+        with open(path, "w") as f:
+            print("No GpackRepos file found, creating one...")
+            print("Add repos with ./gpack add [url] [dir] [branch]")
+
+def getManifest():
+    """Returns the parsed GpackRepos file, loaded once per process"""
+    return readManifest(manifest.load)
+
+def readManifest(read, *args):
+    """Returns read(GpackRepos path, *args), exits if GpackRepos is invalid"""
+    try:
+        return read(os.path.join(ROOT_DIR, "GpackRepos"), *args)
+    except ValueError as e:  # bad entry or depends_on
+        print("gpack: GpackRepos: %s" % (e,))
+        sys.exit(1)
+
 def getRepos():
     """Returns a list of repositories from GpackRepos file"""
-    repos = []
+    return getManifest().repos
 
-    data = yaml.load(open("GpackRepos"))
-    if data == None:
-        return []
+def getConfig():
+    """Returns the config entry of the GpackRepos file"""
+    return readManifest(manifest.config)
 
-    for key, value in data.items():
-        if key == "config":
-            config = Config(value)
-        else:
-            r = Repo(value)
-            repos.append(r)
-    return repos
+def runPool(func, repos, jobs=None):
+    """Runs func over repos on the asyncio executor
+
+    jobs overrides the jobs setting of the GpackRepos config, host_jobs caps
+    the repos talking to a single remote host. Repos wait for their
+    depends_on repos and are skipped when one of those failed.
+    """
+    config = getConfig()
+    failed = lambda result: getattr(result, "status", None) == report.FAILED
+    return AsyncPool(func, repos, jobs or config.jobs, config.host_jobs, failed,
+        blockedRepo)
+
+def blockedRepo(repo, upstream):
+    """Result of a repo skipped because repos it depends on failed"""
+    progress.write("gpack: skipping %s, %s failed" % (repo.name, ", ".join(upstream)))
+    return report.Result(repo.name, report.BLOCKED, 0.0)
 
 def getRepo(name):
-    """Returns repo object from getRepos if it exist"""
-    if(name in [repo.name for repo in getRepos()]):
-        for repo in getRepos():
-            if repo.name == name:
-                return repo
-    else:
+    """Returns repo object from GpackRepos if it exist
+
+    GpackRepos is only read up to the repo.
+    """
+    repo = readManifest(manifest.find, name)
+    if repo == None:
         help()
+    return repo
 
 def lockAll():
-    for repo in getRepos():
-        lock(repo)
+    with lockState().batch():  # .gpacklock is written once
+        for repo in getRepos():
+            lock(repo)
 
+@trace.traced("lock")
 def lock(repo):
     """Updates .gpacklock file and locks given repository"""
-    os.chdir(ROOT_DIR)
-    checkLock()  # checks if .gpacklock exists
-    with open(".gpacklock", "r+") as f:
-        locked = [line.strip() for line in f.readlines()]
-    open(".gpacklock", "w").close() # deletes file contents
-
-    if repo.directory in locked:
-        if not os.path.isdir(repo.directory):
-            locked = [line for line in locked if line != repo.directory]
-            with open(".gpacklock", "r+") as f:
-                for line in locked:
-                    f.write(line + "\n")
-                return
-
-        locked = [line for line in locked if line != repo.directory]
-        applyPerms(repo, "lock")  # removes write access
-        with open(".gpacklock", "r+") as f:
-            for line in locked:
-                f.write(line + "\n")
-    else:
-        if not os.path.isdir(repo.directory):
-            return
+    lockState().remove(repo.directory)
+    if os.path.isdir(repo.directory):
         applyPerms(repo, "lock")  # removes write access
-        with open(".gpacklock", "r+") as f:
-            for line in locked:
-                f.write(line + "\n")
 
 def unlockAll():
-    for repo in getRepos():
-        unlock(repo)
+    with lockState().batch():  # .gpacklock is written once
+        for repo in getRepos():
+            unlock(repo)
 
+@trace.traced("unlock")
 def unlock(repo):
     """Updates .gpacklock file and unlocks given repository"""
-    os.chdir(ROOT_DIR)
-    checkLock()  # checks if .gpacklock exists
     if not os.path.isdir(repo.directory):
         return
-
-    with open(".gpacklock", "r+") as f:
-        locked = [line.strip() for line in f.readlines()]
-    open(".gpacklock", "w").close() # deletes file contents
-
-    if repo.directory in locked:
-        applyPerms(repo, "unlock")  # grants write access
-        with open(".gpacklock", "r+") as f:
-            for line in locked:
-                f.write(line + "\n")
+    lockState().add(repo.directory)
+    applyPerms(repo, "unlock")  # grants write access
+
+def lockState(reload=False):
+    """Returns the .gpacklock state, loading it once per run or again on reload"""
+    global _lock_state
+    with _lock_state_mutex:
+        if _lock_state == None or reload:
+            _lock_state = LockState(LOCK_FILE)
+        return _lock_state
+
+@trace.traced("applyPerms")
+def applyPerms(repo, action, paths=None):
+    """Applys given chmod permissions to a repository
+
+    paths limits the change to those repo relative paths and their parent
+    directories, otherwise the whole working tree is walked.
+    """
+    if paths == None:
+        perms.apply(repo.directory, action)
     else:
-        locked += [repo.directory]
-        applyPerms(repo, "unlock")  # removes write access
-        with open(".gpacklock", "r+") as f:
-            for line in locked:
-                f.write(line + "\n")
-
-def checkLock():
-    """Checks to see if .gpacklock exists"""
-    if not os.path.isfile(".gpacklock"):
-        open(".gpacklock", "w").close()
-
-def applyPerms(repo, action):
-    """Applys given chmod permissions to a repository"""
-    os.chdir(ROOT_DIR)  # reset back to root dir
-    REPO_DIRECTORY = repo.directory  # directory to repo from root
-    exclude = [".git"]  # exclude certain directories
-    repo_walk = []
-    for root, dirs, files in os.walk(REPO_DIRECTORY, topdown = True):
-        dirs[:] = [d for d in dirs if d not in exclude]  # remove git dir
-        files[:] = [f for f in files if f not in exclude]  # remove .git files
-        repo_walk.append((root, files))
-
-    repo_walk = reversed(repo_walk)  # reverse dir to lock from top dir
-    for directory, files in repo_walk:
-        os.chdir(directory)
-        for file in files:
+        perms.applyPaths(repo.directory, paths, action)
+
+def parseJobs(args):
+    """Removes -j/--jobs N from args, returns (jobs, remaining args)"""
+    jobs = None
+    remaining = []
+    args = iter(args)
+    for arg in args:
+        if arg in ("-j", "--jobs"):
             try:
-                st = os.stat(file)
-            except FileNotFoundError:  # broken links
-                continue
-            if action == "lock":
-                try:
-                    os.chmod(file, st.st_mode & ~stat.S_IWUSR)
-                except PermissionError:
-                    continue
-            elif action == "unlock":
-                try:
-                    os.chmod(file, st.st_mode | stat.S_IWUSR)
-                except PermissionError:
-                    continue
-
-        st = os.stat(directory)
-        if action == "lock":
-            os.chmod(directory, st.st_mode & ~stat.S_IWUSR)
-        elif action == "unlock":
-            os.chmod(directory, st.st_mode | stat.S_IWUSR)
-    os.chdir(ROOT_DIR)  # reset back to root dir
+                jobs = int(next(args))
+            except (StopIteration, ValueError):
+                help()
+            if jobs < 1:
+                help()
+        else:
+            remaining.append(arg)
+    return jobs, remaining
+
+def parseFlag(args, flag):
+    """Removes flag from args, returns (True if it was given, remaining args)"""
+    if flag not in args:
+        return False, args
+    return True, [arg for arg in args if arg != flag]
+
+def parseTrace(args):
+    """Removes --trace FILE from args, returns (trace file, remaining args)"""
+    if "--trace" not in args:
+        return None, args
+    i = args.index("--trace")
+    if i + 1 == len(args):
+        help()
+    return args[i + 1], args[:i] + args[i + 2:]
 
 def parseArgs(args):
     """Parses input arguments for gpack"""
-    if len(args) > 4:  # largest arg count aloud
+    if len(args) > 6:  # largest arg count aloud
         help()
     else:
         if args[0] == "install":
+            jobs, args = parseJobs(args)
+            frozen, args = parseFlag(args, "--frozen")
             if len(args) > 2:
                 help()
             print("Cloning repositories, this could take awhile, please be patient...")
-            install(args[1:])
+            install(args[1:], jobs, frozen)
         elif args[0] == "uninstall":
             if len(args) == 1:
                 print("Removing repositories, this could take awhile, please be patient...")
@@ -297,7 +465,8 @@ def parseArgs(args):
         elif args[0] == "help":
             help()
         elif args[0] == "check":
-            check()
+            jobs, args = parseJobs(args)
+            check(args[1:], jobs)
         elif args[0] == "checkout":
             if len(args) != 2:
                 help()
@@ -309,17 +478,27 @@ def parseArgs(args):
         elif args[0] == "branch":
             if len(args) != 2:
                 help()
-            checkBranch(getRepo(args[1]))
+            checkBranch(args[1])
         elif args[0] == "update":
+            jobs, args = parseJobs(args)
+            frozen, args = parseFlag(args, "--frozen")
             if len(args) > 2:
                 help()
             if len(args) == 1:
-                update()
+                update(jobs, frozen)
             elif len(args) == 2:
-                updateRepo(getRepo(args[1]))
+                repo = getRepo(args[1])
+                result = frozenRepo(repo, getPins()) if frozen else updateRepo(repo)
+                report.summary([result], "Update summary")
+                trash.emptyInBackground(ROOT_DIR)  # the old tree of a re-clone
+        elif args[0] == "pin":
+            if len(args) > 2:
+                help()
+            pin(getRepos() if len(args) == 1 else [getRepo(args[1])])
         elif args[0] == "clean":
+            jobs, args = parseJobs(args)
             if len(args) == 1:
-                clean()
+                clean(jobs)
             elif len(args) == 2:
                 cleanRepo(getRepo(args[1]))
         elif args[0] == "purge":
@@ -327,6 +506,13 @@ def parseArgs(args):
                 help()
             print("This could take awhile, please be patient...")
             purge()
+        elif args[0] == "daemon":
+            if len(args) > 2 or (len(args) == 2 and args[1] != "stop"):
+                help()
+            elif len(args) == 1:
+                daemon.serve(ROOT_DIR, getManifest, lockState)
+            elif daemon.query(ROOT_DIR, {"request": "stop"}) == None:
+                print("No gpack daemon is running for %s" % (ROOT_DIR,))
         elif args[0] == "lock":
             if len(args) > 2:
                 help()
@@ -358,15 +544,23 @@ def help():
        "\tadd [url] [directory] [branch]\n"
        "\t\tAdds a repo to the GpackRepos file given ssh URL and local\n"
        "\t\tdirectory relative to current directory\n"
-       "\tcheck\n"
+       "\tcheck [--offline] [--json] [-j N] [repo]\n"
        "\t\tChecks if all repos are clean and match GpackRepos\n"
-       "\tclean [repo]\n"
-       "\t\tForce cleans local repo directory with git clean -xdff\n"
+       "\t\t--offline compares against local refs without fetching\n"
+       "\t\t--json prints the report as JSON\n"
+       "\tclean [-j N] [repo]\n"
+       "\t\tForce cleans local repo directory back to origin/<branch>,\n"
+       "\t\tonly the paths git status reports are touched\n"
+       "\tdaemon [stop]\n"
+       "\t\tKeeps the workspace state in memory, updated with inotify, so\n"
+       "\t\tlist, branch, check --offline and no-op updates answer at once\n"
        "\thelp\n"
        "\t\tDisplays this message\n"
-       "\tinstall [-nogui]\n"
+       "\tinstall [-nogui] [-j N] [--frozen]\n"
        "\t\tClones repos in repo directory\n"
-       "\t\t-nogui doesn't open terminals when installing\n"
+       "\t\t-nogui doesn't show clone progress when installing\n"
+       "\t\t-j, --jobs N clones at most N repos at once\n"
+       "\t\t--frozen checks out the commits pinned in GpackRepos.lock\n"
        "\tlist\n"
        "\t\tList all repos in GpackRepos file\n"
        "\tlock [repo]\n"
@@ -376,10 +570,20 @@ def help():
        "\t\tAdd -f to force remove all repositories\n"
        "\tunlock [repo]\n"
        "\t\tAllows writing to all repos, appends to .gpacklock file\n"
+       "\tpin [repo]\n"
+       "\t\tRecords the checked out commits in GpackRepos.lock\n"
        "\tpurge\n"
        "\t\tRemoves all repos and re-clones from remote\n"
-       "\tupdate [repo]\n"
+       "\tupdate [-j N] [--frozen] [repo]\n"
        "\t\tCleans all repos in GpackRepos, resetting it to the default\n"
+       "\t\t-j, --jobs N updates at most N repos at once\n"
+       "\t\t--frozen moves repos to their pinned commits, repos already\n"
+       "\t\tthere are skipped without network access\n"
+       "\nOptions\n"
+       "-------\n"
+       "\t--trace [file]\n"
+       "\t\tRecords every gpack phase and git command of the run as a\n"
+       "\t\tChrome trace-event file and prints the slowest operations\n"
        "\nGit Commands\n"
        "------------\n"
        "\tbranch [repo]\n"
@@ -396,27 +600,36 @@ def help():
        "\t\tAsks user which tag to checkout for a repo. If given tag\n"
        "\t\tdoesn't texists, ask for a new tag to create\n")
     print(msg)
-    os.chdir(ROOT_DIR)
     ssh.remove_key(ROOT_DIR)
     sys.exit()  # force termination
 
 def main(args):
-    if len(args) != 0:
-        ssh.download_key(ROOT_DIR)
-        parseArgs(args)
-        ssh.remove_key(ROOT_DIR)
-    else:
-        help()
-
-if __name__ == "__main__":
-    """Running gpack from gpack.py not bash file"""
-    args = sys.argv[1:]
+    trace_file, args = parseTrace(args)
+    if trace_file != None:
+        trace.enable()
     try:
         if len(args) != 0:
-            ssh.download_key(ROOT_DIR)
-            parseArgs(args)
-            ssh.remove_key(ROOT_DIR)
+            createManifest()
+            if args[0] in REMOTE_COMMANDS and "--offline" not in args:  # local ones never need the key
+                repos = None
+                if args[0] in SINGLE_COMMANDS and len(args) == 2:
+                    repos = [getRepo(args[1])]  # leaves the rest of GpackRepos unread
+                ssh.download_key(ROOT_DIR)
+                if getConfig().ssh_multiplex:
+                    ssh.multiplex(repos or getRepos())
+            with trace.span(args[0]):
+                parseArgs(args)
         else:
             help()
+    finally:
+        ssh.remove_key(ROOT_DIR)  # also stops the ssh masters
+        if trace_file != None:
+            trace.export(trace_file)
+            trace.summary()
+
+if __name__ == "__main__":
+    """Running gpack from gpack.py not bash file"""
+    try:
+        main(sys.argv[1:])
     except Exception:
         pass
@@ -0,0 +1,192 @@
+"""Offline gpack benchmark against generated local bare repositories
+
+Builds N bare repos (served over file://) with a configurable number of
+files, file size, history depth and submodules, writes a matching GpackRepos
+and times every gpack command at each N. Results are written as JSON so runs
+of different releases can be compared.
+
+    python3 benchmark.py --repos 5,20,50 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+GPACK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gpack.py")
+
+# submodules over file:// are refused by default since git 2.38.1
+GIT_ENV = {"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "protocol.file.allow",
+    "GIT_CONFIG_VALUE_0": "always"}
+
+def git(args, cwd=None, stdin=None):
+    """Runs git, returns its stdout"""
+    env = dict(os.environ, **GIT_ENV)
+    process = subprocess.run(["git"] + args, cwd=cwd, input=stdin, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return process.stdout.decode("utf-8").strip()
+
+def blob(size, seed):
+    """Returns size bytes of deterministic file content"""
+    line = ("gpack benchmark %d " % (seed,)).encode("utf-8")
+    return (line * (size // len(line) + 1))[:size]
+
+def commit(mark, parent, message, files, stamp):
+    """Returns a fast-import commit of files ({path: bytes} or (mode, sha))"""
+    stream = [b"commit refs/heads/master\n", b"mark :%d\n" % (mark,),
+        b"committer gpack <gpack@bench> %d +0000\n" % (stamp,),
+        b"data %d\n%s\n" % (len(message), message.encode("utf-8"))]
+    if parent != None:
+        stream.append(b"from %s\n" % (parent.encode("utf-8"),))
+    for path, content in sorted(files.items()):
+        if isinstance(content, tuple):  # gitlink
+            stream.append(b"M %s %s %s\n" % (content[0].encode("utf-8"),
+                content[1].encode("utf-8"), path.encode("utf-8")))
+        else:
+            stream.append(b"M 100644 inline %s\n" % (path.encode("utf-8"),))
+            stream.append(b"data %d\n%s\n" % (len(content), content))
+    return b"".join(stream)
+
+def history(bare, files, size, depth, extra=None, parent=None, start=0):
+    """Appends depth commits to the master branch of a bare repo"""
+    stream = []
+    for i in range(depth):
+        if i == 0 and parent == None:
+            changed = dict(("src/dir%d/file%d.txt" % (f % 10, f), blob(size, f))
+                for f in range(files))
+            changed.update(extra or {})
+        else:
+            f = (start + i) % files
+            changed = {"src/dir%d/file%d.txt" % (f % 10, f): blob(size, start + i + files)}
+        mark_parent = parent if i == 0 else ":%d" % (i,)
+        stream.append(commit(i + 1, mark_parent, "commit %d" % (start + i,),
+            changed, 1500000000 + start + i))
+    git(["fast-import", "--quiet"], cwd=bare, stdin=b"".join(stream))
+
+def fixtures(root, n, args):
+    """Creates n bare repos plus shared submodules, returns the GpackRepos text"""
+    remotes = os.path.join(root, "remotes")
+    os.makedirs(remotes)
+
+    extra = {}
+    gitmodules = []
+    for s in range(args.submodules):
+        bare = os.path.join(remotes, "sub%d.git" % (s,))
+        git(["init", "--quiet", "--bare", bare])
+        history(bare, args.files, args.file_size, 1)
+        sha = git(["rev-parse", "master"], cwd=bare)
+        extra["sub%d" % (s,)] = ("160000", sha)
+        gitmodules.append("[submodule \"sub%d\"]\n\tpath = sub%d\n\turl = file://%s\n"
+            % (s, s, bare))
+    if gitmodules:
+        extra[".gitmodules"] = "".join(gitmodules).encode("utf-8")
+
+    manifest = []
+    for i in range(n):
+        bare = os.path.join(remotes, "repo%d.git" % (i,))
+        git(["init", "--quiet", "--bare", bare])
+        history(bare, args.files, args.file_size, args.depth, extra)
+        manifest.append("repo%d:\n    url: file://%s\n    local_dir: ./repos/repo%d\n"
+            "    branch: master\n" % (i, bare, i))
+    return "\n".join(manifest)
+
+def push_commits(root, n, args, round):
+    """Adds one commit to every remote so update has work to do"""
+    for i in range(n):
+        bare = os.path.join(root, "remotes", "repo%d.git" % (i,))
+        history(bare, args.files, args.file_size, 1, parent="refs/heads/master^0",
+            start=args.depth + round)
+
+def gpack(workspace, command):
+    """Runs one gpack command in workspace, returns its wall time
+
+    Exits with the command output if it fails, a failed run would be timed
+    as a fast one.
+    """
+    env = dict(os.environ, **GIT_ENV)
+    start = time.time()
+    result = subprocess.run([sys.executable, GPACK] + command, cwd=workspace, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    elapsed = time.time() - start
+    if result.returncode != 0:
+        sys.exit("gpack %s failed with exit code %d:\n%s" % (" ".join(command),
+            result.returncode, result.stdout.decode("utf-8", "replace")[-4000:]))
+    return elapsed
+
+def bench(n, args):
+    """Times every scenario for n repos, returns a list of result dicts"""
+    results = []
+    root = tempfile.mkdtemp(prefix="gpack_bench_")
+    try:
+        workspace = os.path.join(root, "workspace")
+        os.makedirs(workspace)
+        with open(os.path.join(workspace, "GpackRepos"), "w") as f:
+            f.write(fixtures(root, n, args))
+
+        def record(name, command, before=None, after=None):
+            times = []
+            for round in range(args.rounds):
+                if before != None:
+                    before(round)
+                times.append(gpack(workspace, command))
+                if after != None:
+                    after(round)
+            results.append({"repos": n, "scenario": name, "command": command,
+                "times": times, "min": min(times),
+                "median": statistics.median(times)})
+            print("%4d repos  %-16s %8.3fs" % (n, name, statistics.median(times)))
+
+        uninstall = lambda round: gpack(workspace, ["uninstall"])
+        record("install", ["install", "-nogui"], after=lambda round:
+            round + 1 < args.rounds and uninstall(round))
+        record("update-noop", ["update"])
+        record("update-commits", ["update"],
+            before=lambda round: push_commits(root, n, args, round))
+        record("clean", ["clean"])
+        record("unlock", ["unlock"])
+        record("lock", ["lock"])
+        record("check", ["check"])
+        record("uninstall", ["uninstall"], after=lambda round:
+            round + 1 < args.rounds and gpack(workspace, ["install", "-nogui"]))
+    finally:
+        for directory, dirs, files in os.walk(root):  # locked trees are read-only
+            os.chmod(directory, 0o755)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repos", default="5,20,50",
+        help="comma separated repo counts to benchmark")
+    parser.add_argument("--files", type=int, default=100, help="files per repo")
+    parser.add_argument("--file-size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--depth", type=int, default=20, help="commits per repo")
+    parser.add_argument("--submodules", type=int, default=0, help="submodules per repo")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per scenario")
+    parser.add_argument("--output", default="bench_output.json",
+        help="JSON results file")
+    args = parser.parse_args()
+
+    results = []
+    for n in [int(n) for n in args.repos.split(",")]:
+        results += bench(n, args)
+
+    revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+        cwd=os.path.dirname(GPACK), stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL).stdout.decode("utf-8").strip()
+    with open(args.output, "w") as f:
+        json.dump({"revision": revision, "python": platform.python_version(),
+            "git": git(["--version"]), "platform": platform.platform(),
+            "params": {"files": args.files, "file_size": args.file_size,
+                "depth": args.depth, "submodules": args.submodules,
+                "rounds": args.rounds},
+            "results": results}, f, indent=2)
+    print("Results written to %s" % (args.output,))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import subprocess
+
+# file:// submodules are refused by default since git 2.38.1
+os.environ["GIT_CONFIG_COUNT"] = "1"
+os.environ["GIT_CONFIG_KEY_0"] = "protocol.file.allow"
+os.environ["GIT_CONFIG_VALUE_0"] = "always"
+
+def git(cwd, *args):
+    """Runs git in cwd as a test user, returns its stripped output"""
+    return subprocess.check_output(["git", "-c", "user.name=gpack",
+        "-c", "user.email=gpack@test", "-c", "init.defaultBranch=master"] + list(args),
+        cwd=cwd, stderr=subprocess.DEVNULL).decode("utf-8").strip()
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+def remote(root, name, files=None):
+    """Creates the bare remote root/name.git with one commit of files
+
+    Returns (url, work) where work is a clone used to push new commits.
+    """
+    bare = os.path.join(root, name + ".git")
+    work = os.path.join(root, name + "-work")
+    git(root, "init", "-q", "--bare", bare)
+    git(root, "clone", "-q", bare, work)
+    for path, content in (files or {"f.txt": "hi\n", "d/y.txt": "x\n"}).items():
+        write(os.path.join(work, path), content)
+    commit(work, "init")
+    return "file://" + bare, work
+
+def commit(work, message, branch="master"):
+    """Commits everything in work and pushes it to branch"""
+    git(work, "add", "-A")
+    git(work, "commit", "-q", "--allow-empty", "-m", message)
+    git(work, "push", "-q", "origin", "HEAD:" + branch)
+    return git(work, "rev-parse", "HEAD")
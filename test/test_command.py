@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util import command
+
+class TestCommand(TestCase):
+    """Testing the central command runner"""
+    def test_cwd(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            result = command.run(["git", "init", "-q"], cwd=directory)
+            self.assertTrue(result.ok)
+            self.assertTrue(os.path.isdir(os.path.join(directory, ".git")))
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_failure(self):
+        with tempfile.TemporaryDirectory() as directory:
+            result = command.run(["git", "log"], cwd=directory)
+            self.assertFalse(result.ok)
+            self.assertTrue(command.error(result.output).startswith("gpack"))
+
+    def test_missing_cwd(self):
+        result = command.run(["git", "status"], cwd="/nonexistent/gpack")
+        self.assertFalse(result.ok)
+
+class TestLineSplitter(TestCase):
+    """Testing the split of streamed git output"""
+    def setUp(self):
+        self.lines = []
+        self.splitter = command.LineSplitter(self.lines.append)
+
+    def test_progress(self):
+        chunks = [b"Receiving objects:  10%\rReceiving", b" objects: 100%, done.\n",
+            b"ERROR: Repository not found.\r", b"\nfatal: could not read\n", b"tail"]
+        for chunk in chunks:
+            self.splitter.feed(chunk)
+        output = self.splitter.close()
+        self.assertEqual(self.lines, ["Receiving objects:  10%",
+            "Receiving objects: 100%, done.", "ERROR: Repository not found.",
+            "fatal: could not read", "tail"])
+        self.assertEqual(output, "Receiving objects: 100%, done.\n"
+            "ERROR: Repository not found.\nfatal: could not read\ntail")  # no 10%
+        self.assertEqual(self.splitter.size, sum(len(chunk) for chunk in chunks))
+
+    def test_crlf_error(self):
+        self.splitter.feed(b"ERROR: Repository not found.\r\n")
+        self.assertEqual(self.splitter.close(), "ERROR: Repository not found.\n")
+        self.assertEqual(command.error("ERROR: x\n"), "ERROR: x")
+
+if __name__ == "__main__":
+    test_main()
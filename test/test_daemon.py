@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import main as test_main, skipUnless, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixtures import git, write, remote
+import gpack
+from core.util import daemon
+from core.util import perms
+from core.util.lockstate import LockState
+
+ENTRY = "%s:\n    url: %s\n    local_dir: %s\n    branch: master\n    lock: false\n"
+
+def until(get, expected, timeout=5.0):
+    """Returns get() once it equals expected, or its last value after timeout"""
+    deadline = time.time() + timeout
+    value = get()
+    while value != expected and time.time() < deadline:
+        time.sleep(0.05)
+        value = get()
+    return value
+
+@skipUnless(sys.platform.startswith("linux"), "the daemon needs inotify")
+class TestDaemon(TestCase):
+    """Testing the inotify daemon against a temporary gpack root"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        gpack.ROOT_DIR = self.root
+        gpack.LOCK_FILE = os.path.join(self.root, ".gpacklock")
+        self.url, work = remote(self.root, "a")
+        self.directory = os.path.join(self.root, "repos", "a")
+        git(self.root, "clone", "-q", self.url, self.directory)
+        write(os.path.join(self.root, "GpackRepos"), ENTRY % ("a", self.url, self.directory))
+        self.thread = threading.Thread(target=daemon.serve,
+            args=(self.root, gpack.getManifest, gpack.lockState), daemon=True)
+        self.thread.start()
+        until(lambda: self.query("ping") != None, True)
+
+    def tearDown(self):
+        self.query("stop")
+        self.thread.join(5)
+        perms.apply(self.root, "unlock")
+        self.tmp.cleanup()
+
+    def query(self, kind, repo=None):
+        return daemon.query(self.root, {"request": kind, "repo": repo})
+
+    def branch(self):
+        return self.query("branch", "a")["branches"]["a"]
+
+    def state(self, key):
+        return self.query("check")["states"][0][key]
+
+    def test_list_and_reload(self):
+        self.assertEqual(self.query("list"), {"names": ["a"]})
+        with open(os.path.join(self.root, "GpackRepos"), "a") as f:
+            f.write(ENTRY % ("b", self.url, os.path.join(self.root, "repos", "b")))
+        self.assertEqual(until(lambda: self.query("list"), {"names": ["a", "b"]}),
+            {"names": ["a", "b"]})
+        self.assertEqual(self.query("branch", "c"), {"error": "c is not in GpackRepos"})
+
+    def test_working_tree_changes(self):
+        self.assertEqual(self.branch(), "master")
+        self.assertEqual(self.state("changes"), 0)
+        git(self.directory, "checkout", "-q", "-b", "topic")
+        self.assertEqual(until(self.branch, "topic"), "topic")
+        write(os.path.join(self.directory, "d", "new.txt"), "new\n")
+        self.assertEqual(until(lambda: self.state("changes"), 1), 1)
+        os.remove(os.path.join(self.directory, "d", "new.txt"))
+        self.assertEqual(until(lambda: self.state("changes"), 0), 0)
+
+    def test_lock_file_reload(self):
+        self.assertFalse(self.state("expected_locked"))  # lock: false
+        with open(os.path.join(self.root, "GpackRepos"), "w") as f:
+            f.write(ENTRY.replace("false", "true") % ("a", self.url, self.directory))
+        self.assertTrue(until(lambda: self.state("expected_locked"), True))
+        LockState(gpack.LOCK_FILE).add(self.directory)  # another gpack unlocks it
+        self.assertFalse(until(lambda: self.state("expected_locked"), False))
+
+    def test_stop(self):
+        self.assertEqual(self.query("stop"), {"pid": os.getpid()})
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(daemon.socketPath(self.root)))
+        self.assertEqual(self.query("list"), None)  # callers fall back
+
+    def test_watch_failure(self):
+        def fail(inotify):
+            raise OSError("inotify went away")
+        original = daemon.inotify.Inotify.read
+        daemon.inotify.Inotify.read = fail
+        try:
+            write(os.path.join(self.directory, "f.txt"), "wakes the watcher\n")
+            self.thread.join(5)  # the daemon stops rather than serve stale states
+        finally:
+            daemon.inotify.Inotify.read = original
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(self.query("list"), None)
+
+if __name__ == "__main__":
+    test_main()
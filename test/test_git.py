@@ -0,0 +1,247 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixtures import git, write, remote, commit
+import gpack
+from core.util import git as gpack_git
+from core.util import perms
+from core.util import report
+from core.repo import Repo
+
+class TestRinse(TestCase):
+    """Testing the targeted rinse of dirty checkouts"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        url, work = remote(root, "a")
+        sub_url, sub_work = remote(root, "sub")
+        git(work, "submodule", "add", "-q", sub_url, "sub")
+        commit(work, "add sub")
+        self.directory = os.path.join(root, "a")
+        git(root, "clone", "-q", "--recursive", url, self.directory)
+        self.repo = Repo({"url": url, "local_dir": self.directory, "branch": "master"})
+
+    def tearDown(self):
+        perms.apply(self.tmp.name, "unlock")
+        self.tmp.cleanup()
+
+    def dirty(self):
+        """Makes every kind of change rinse has to undo"""
+        write(os.path.join(self.directory, "f.txt"), "edited\n")
+        write(os.path.join(self.directory, "n.txt"), "new\n")
+        git(self.directory, "add", "n.txt")
+        write(os.path.join(self.directory, "d", "u.txt"), "untracked\n")
+        write(os.path.join(self.directory, "sub", "f.txt"), "edited\n")
+
+    def test_dirty_paths(self):
+        self.assertEqual(gpack_git.dirtyPaths(self.directory), ([], [], {}, False))
+        self.dirty()
+        tracked, untracked, submodules, unmerged = gpack_git.dirtyPaths(self.directory)
+        self.assertEqual(sorted(tracked), ["f.txt", "n.txt"])
+        self.assertEqual(untracked, ["d/u.txt"])
+        self.assertEqual(list(submodules), ["sub"])
+        self.assertEqual(submodules["sub"][2], "M")
+        self.assertFalse(unmerged)
+
+    def test_rinse_tree(self):
+        self.dirty()
+        permitted = []
+        self.assertTrue(gpack_git.rinseTree(self.repo, self.directory, "origin/master",
+            permitted.extend))
+        self.assertTrue(gpack_git.localClean(self.directory))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "n.txt")))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "d", "u.txt")))
+        with open(os.path.join(self.directory, "sub", "f.txt")) as f:
+            self.assertEqual(f.read(), "hi\n")
+        self.assertEqual(sorted(permitted), ["d/u.txt", "f.txt", "n.txt", "sub/f.txt"])
+
+    def test_rinse_locked(self):
+        perms.apply(self.directory, "lock")
+        self.dirty()
+        self.assertTrue(gpack_git.rinse(self.repo, locked=True))
+        self.assertTrue(gpack_git.localClean(self.directory))
+        for path in ["d", "f.txt", os.path.join("sub", "f.txt")]:
+            mode = os.stat(os.path.join(self.directory, path)).st_mode
+            self.assertFalse(mode & stat.S_IWUSR, path)  # locked again
+
+    def test_rinse_moves_to_target(self):
+        url, work = self.repo.url, os.path.join(self.tmp.name, "a-work")
+        write(os.path.join(work, "f.txt"), "new tip\n")
+        commit(work, "tip")
+        git(self.directory, "fetch", "-q")
+        self.dirty()
+        self.assertTrue(gpack_git.rinse(self.repo))
+        self.assertEqual(gpack_git.revParse(self.directory, "HEAD"),
+            gpack_git.revParse(self.directory, "origin/master"))
+        self.assertTrue(gpack_git.localClean(self.directory))
+
+class TestCheck(TestCase):
+    """Testing the drift, ahead and behind report of check"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        gpack.LOCK_FILE = os.path.join(root, ".gpacklock")
+        gpack.lockState(reload=True)
+        url, self.work = remote(root, "a")
+        sub_url, self.sub_work = remote(root, "sub")
+        git(self.work, "submodule", "add", "-q", sub_url, "sub")
+        commit(self.work, "add sub")
+        self.directory = os.path.join(root, "a")
+        git(root, "clone", "-q", "--recursive", url, self.directory)
+        self.repo = Repo({"url": url, "local_dir": self.directory, "branch": "master"})
+        perms.apply(self.directory, "lock")
+
+    def tearDown(self):
+        perms.apply(self.tmp.name, "unlock")
+        self.tmp.cleanup()
+
+    def test_clean(self):
+        state = gpack_git.check(self.repo)
+        self.assertEqual((state["branch"], state["changes"], state["ahead"],
+            state["behind"], state["submodules"]), ("master", 0, 0, 0, []))
+        self.assertTrue(state["locked"] and state["expected_locked"])
+        self.assertTrue(state["ok"])
+
+    def test_behind(self):
+        commit(self.work, "remote")
+        self.assertEqual(gpack_git.check(self.repo, offline=True)["behind"], 0)
+        state = gpack_git.check(self.repo)  # fetches origin/master first
+        self.assertEqual((state["ahead"], state["behind"], state["ok"]), (0, 1, False))
+
+    def test_ahead_and_changes(self):
+        git(self.directory, "commit", "-q", "--allow-empty", "-m", "local")
+        perms.apply(self.directory, "unlock")
+        write(os.path.join(self.directory, "u.txt"), "untracked\n")
+        write(os.path.join(self.directory, "f.txt"), "edited\n")
+        state = gpack_git.check(self.repo, offline=True)
+        self.assertEqual((state["ahead"], state["behind"], state["changes"]), (1, 0, 2))
+        self.assertFalse(state["locked"])
+        self.assertFalse(state["ok"])
+
+    def test_submodule_drift(self):
+        sub = os.path.join(self.directory, "sub")
+        git(sub, "commit", "-q", "--allow-empty", "-m", "moved")
+        state = gpack_git.check(self.repo, offline=True)
+        self.assertEqual((state["submodules"], state["changes"]), (["sub"], 0))
+        self.assertFalse(state["ok"])
+
+    def test_other_branch(self):
+        git(self.directory, "checkout", "-q", "-b", "topic")
+        state = gpack_git.check(self.repo, offline=True)
+        self.assertEqual((state["branch"], state["ahead"], state["behind"]),
+            ("topic", 0, 0))
+        self.assertFalse(state["ok"])
+
+    def test_missing(self):
+        perms.apply(self.directory, "unlock")
+        shutil.rmtree(self.directory)
+        state = gpack_git.check(self.repo, offline=True)
+        self.assertFalse(state["present"] or state["ok"])
+
+class TestFrozen(TestCase):
+    """Testing the move of a checkout to its lockfile pin"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        gpack.LOCK_FILE = os.path.join(root, ".gpacklock")
+        gpack.lockState(reload=True)
+        url, self.work = remote(root, "a")
+        sub_url, sub_work = remote(root, "sub")
+        git(self.work, "submodule", "add", "-q", sub_url, "sub")
+        self.old = commit(self.work, "add sub")
+        self.directory = os.path.join(root, "a")
+        git(root, "clone", "-q", "--recursive", url, self.directory)
+        self.repo = Repo({"url": url, "local_dir": self.directory, "branch": "master"})
+        perms.apply(self.directory, "lock")
+
+    def tearDown(self):
+        perms.apply(self.tmp.name, "unlock")
+        self.tmp.cleanup()
+
+    def writable(self, path):
+        return bool(os.stat(os.path.join(self.directory, path)).st_mode & stat.S_IWUSR)
+
+    def test_fetch_by_sha(self):
+        write(os.path.join(self.work, "f.txt"), "pinned\n")
+        sha = commit(self.work, "pinned")
+        git(self.work, "commit", "-q", "--allow-empty", "-m", "after the pin")
+        git(self.work, "push", "-q", "origin", "HEAD:master")
+        pin = dict(gpack_git.pin(self.repo), sha=sha)
+        self.assertEqual(gpack_git.frozen(self.repo, pin), report.UPDATED)
+        self.assertTrue(gpack_git.pinned(self.repo, pin))
+        self.assertFalse(self.writable("f.txt"))  # locked again
+
+    def test_failure_relocks(self):
+        pin = gpack_git.pin(self.repo)
+        pin["submodules"] = {"sub": "0" * 40}  # can't be fetched
+        self.assertEqual(gpack_git.frozen(self.repo, pin), report.FAILED)
+        for path in ["", "sub", os.path.join("sub", "f.txt")]:
+            self.assertFalse(self.writable(path), path)
+
+class TestRemote(TestCase):
+    """Testing commitsMatch and the ls-remote shortcut of update"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        self.url, self.work = remote(root, "a")
+        git(self.work, "push", "-q", "origin", "HEAD:release")
+        self.directory = os.path.join(root, "a")
+        git(root, "clone", "-q", self.url, self.directory)
+        self.repos = [Repo({"url": self.url, "local_dir": self.directory,
+            "branch": branch}) for branch in ["master", "release"]]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_commits_match(self):
+        repo = self.repos[0]
+        self.assertTrue(gpack_git.commitsMatch(repo))
+        commit(self.work, "remote")
+        self.assertTrue(gpack_git.commitsMatch(repo))  # not fetched yet
+        git(self.directory, "fetch", "-q")
+        self.assertFalse(gpack_git.commitsMatch(repo))
+        self.assertTrue(gpack_git.behind(repo))
+
+    def test_ls_remote(self):
+        master = commit(self.work, "remote")
+        release = git(self.work, "rev-parse", "HEAD~1")
+        self.assertEqual(gpack_git.lsRemote(self.url, ["master", "release", "none"]),
+            {"master": master, "release": release})
+        gpack_git.remoteHeads(self.repos, jobs=2)
+        self.assertEqual([repo.remote_sha for repo in self.repos], [master, release])
+
+    def test_host_jobs(self):
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def lsRemote(url, branches):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return {"master": url}
+
+        repos = [Repo({"url": "git@host:r%d.git" % (i,), "local_dir": self.directory,
+            "branch": "master"}) for i in range(6)]
+        original, gpack_git.lsRemote = gpack_git.lsRemote, lsRemote
+        try:
+            gpack_git.remoteHeads(repos, jobs=6, host_jobs=2)
+        finally:
+            gpack_git.lsRemote = original
+        self.assertEqual(peak[0], 2)  # one host, at most host_jobs sessions
+        self.assertEqual([repo.remote_sha for repo in repos], [repo.url for repo in repos])
+
+    def test_ls_remote_failure(self):
+        self.assertEqual(gpack_git.lsRemote(self.url + ".missing", ["master"]), {})
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
+from unittest import main as test_main, TestCase
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gpack")
+
+class Handler(SimpleHTTPRequestHandler):
+    """Static file handler answering If-None-Match with 304 and counting requests"""
+    def send_head(self):
+        self.server.requests.append(self.headers.get("If-None-Match"))
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                etag = '"%s"' % (hashlib.sha1(f.read()).hexdigest(),)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return None
+            self.etag = etag
+        return super().send_head()
+
+    def end_headers(self):
+        if getattr(self, "etag", None):
+            self.send_header("ETag", self.etag)
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class TestLauncher(TestCase):
+    """Testing the cached self-update of the gpack launcher"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.site = os.path.join(self.tmp.name, "site")
+        os.makedirs(self.site)
+        self.build("1")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0),
+            partial(Handler, directory=self.site))
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.env = dict(os.environ,
+            GPACK_URL="http://127.0.0.1:%d/gpack.zip" % (self.server.server_port,),
+            GPACK_CACHE_DIR=os.path.join(self.tmp.name, "cache"),
+            GPACK_UPDATE_INTERVAL="3600")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def build(self, version):
+        """Writes a gpack.zip that prints version and its arguments"""
+        with zipfile.ZipFile(os.path.join(self.site, "gpack.zip"), "w") as f:
+            f.writestr("__main__.py", "import sys\nprint('%s', *sys.argv[1:])\n" % (version,))
+
+    def gpack(self, *args):
+        process = subprocess.run([LAUNCHER] + list(args), env=self.env,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return process.stdout.decode("utf-8").strip()
+
+    def test_cached(self):
+        self.assertEqual(self.gpack("list"), "1 list")
+        self.build("2")
+        self.assertEqual(self.gpack("list"), "1 list")  # not due yet
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_revalidate(self):
+        self.env["GPACK_UPDATE_INTERVAL"] = "0"
+        self.assertEqual(self.gpack(), "1")
+        self.assertEqual(self.gpack(), "1")
+        self.assertTrue(self.server.requests[1] != None)  # conditional request
+        self.build("2")
+        self.assertEqual(self.gpack(), "2")
+
+    def test_unreachable(self):
+        self.assertEqual(self.gpack(), "1")
+        self.env["GPACK_UPDATE_INTERVAL"] = "0"
+        self.env["GPACK_URL"] = "http://127.0.0.1:1/gpack.zip"
+        self.assertEqual(self.gpack(), "1")
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import threading
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util.lockstate import LockState
+
+class TestLockState(TestCase):
+    """Testing the .gpacklock state store"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, ".gpacklock")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.path) as f:
+            return set(f.read().split())
+
+    def test_add_remove(self):
+        state = LockState(self.path)
+        state.add("/repos/a")
+        state.add("/repos/b")
+        state.remove("/repos/a")
+        self.assertEqual(self.read(), {"/repos/b"})
+        self.assertTrue("/repos/b" in LockState(self.path))
+
+    def test_batch(self):
+        state = LockState(self.path)
+        with state.batch():
+            state.add("/repos/a")
+            self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.read(), {"/repos/a"})
+
+    def test_threads(self):
+        state = LockState(self.path)
+        threads = [threading.Thread(target=state.add, args=("/repos/%d" % i,))
+            for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.read()), 50)
+
+    def test_merge(self):
+        first = LockState(self.path)
+        second = LockState(self.path)
+        first.add("/repos/a")
+        second.add("/repos/b")  # must not drop the entry of the other writer
+        self.assertEqual(self.read(), {"/repos/a", "/repos/b"})
+
+    def test_no_op(self):
+        state = LockState(self.path)
+        state.remove("/repos/a")  # already locked
+        self.assertFalse(os.path.exists(self.path))
+        state.add("/repos/a")
+        mtime = os.stat(self.path).st_mtime_ns
+        state.add("/repos/a")
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+        self.assertEqual(os.listdir(self.tmp.name), [".gpacklock"])  # no guard file
+
+if __name__ == "__main__":
+    test_main()
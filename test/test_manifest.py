@@ -0,0 +1,99 @@
+import os
+import sys
+import tempfile
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util import manifest
+
+MANIFEST = """config:
+    jobs: 4
+    manifest_cache: %s
+
+defaults: &defaults
+    url: file:///remotes/a.git
+    local_dir: ./repos/a
+    branch: master
+
+b:
+    <<: *defaults
+    local_dir: ./repos/b
+    depth: 0x10
+    depends_on: [a]
+
+c:
+    url: 'file:///remotes/c.git'
+    local_dir: "./repos/c"
+    branch: 'yes'
+    lock: off
+"""
+
+class TestManifest(TestCase):
+    """Testing the streaming GpackRepos parser"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "GpackRepos")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def test_load(self):
+        self.write(MANIFEST % ("false",))
+        loaded = manifest.load(self.path)
+        self.assertEqual(loaded.config.jobs, 4)
+        self.assertFalse(loaded.config.ssh_multiplex)  # opt-in
+        self.assertEqual([repo.name for repo in loaded.repos], ["a", "b", "c"])
+        b, c = loaded.index["b"], loaded.index["c"]
+        self.assertEqual((b.url, b.branch, b.depth, b.depends_on),
+            ("file:///remotes/a.git", "master", 16, ["a"]))
+        self.assertEqual((c.branch, c.lock), ("yes", False))
+        with self.assertRaises(AttributeError):
+            b.extra = True  # __slots__
+
+    def test_matches_safe_load(self):
+        import yaml
+        self.write(MANIFEST % ("false",))
+        with open(self.path) as f:
+            expected = yaml.safe_load(f)
+        self.assertEqual([(key, value) for key, value, line in manifest.read(self.path)],
+            list(expected.items()))
+
+    def test_find(self):
+        self.write(MANIFEST % ("false",))
+        self.assertEqual(manifest.find(self.path, "a").url, "file:///remotes/a.git")
+        self.assertEqual(manifest.config(self.path).jobs, 4)
+        self.assertEqual(manifest.find(self.path, "missing"), None)
+
+    def test_cache(self):
+        self.write(MANIFEST % ("true",))
+        parsed = list(manifest.read(self.path))
+        self.assertTrue(os.path.isfile(manifest.cachePath(self.path)))
+        self.assertEqual([list(entry) for entry in manifest.read(self.path)],
+            [list(entry) for entry in parsed])
+
+    def test_invalid(self):
+        for content in ["- a\n", "a:\n    url: x\n    local_dir: ./a\n",
+            "a:\n    url: x\n    local_dir: ./a\n    branch: 1.0\n",
+            "a:\n    url: x\n    local_dir: ./a\n    branch: m\n    depth: yes\n",
+            "a: [\n", "config:\n    jobs: 1\nconfig:\n    jobs: 2\n"]:
+            self.write(content)
+            with self.assertRaises(ValueError):
+                manifest.Manifest(manifest.read(self.path))
+
+    def test_config_lock(self):
+        self.write("config:\n    lock: false\n"
+            "a:\n    url: x\n    local_dir: ./a\n    branch: m\n"
+            "b:\n    url: x\n    local_dir: ./b\n    branch: m\n    lock: true\n")
+        loaded = manifest.Manifest(manifest.read(self.path))
+        self.assertEqual([repo.lock for repo in loaded.repos], [False, True])
+
+    def test_empty(self):
+        self.write("# no repos yet\n")
+        self.assertEqual(manifest.Manifest(manifest.read(self.path)).repos, [])
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import sys
+import tempfile
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixtures import git, write, remote, commit
+import gpack
+from core.util import command
+from core.util import git as gpack_git
+from core.util import mirror
+from core.util import perms
+from core.util import report
+from core.repo import Repo
+
+class TestMirror(TestCase):
+    """Testing the per url mirrors clones borrow objects from"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        gpack.LOCK_FILE = os.path.join(self.root, ".gpacklock")
+        gpack.lockState(reload=True)
+        self.url, self.work = remote(self.root, "a")
+        self.mirrors = os.path.join(self.root, "mirrors")
+        self.mirror = mirror.path(self.url, self.mirrors)
+        mirror._synced.clear()  # mirrors are synced once per process
+        self.repos = [Repo({"url": self.url, "local_dir": os.path.join(self.root, name),
+            "branch": "master", "mirror": self.mirrors}) for name in ["a", "b"]]
+
+    def tearDown(self):
+        perms.apply(self.root, "unlock")
+        self.tmp.cleanup()
+
+    def test_sync_once(self):
+        self.assertEqual(mirror.sync(self.url, self.mirrors), self.mirror)
+        sha = commit(self.work, "remote")
+        self.assertEqual(mirror.sync(self.url, self.mirrors), self.mirror)
+        self.assertNotEqual(git(self.mirror, "rev-parse", "master"), sha)  # not fetched
+        mirror._synced.clear()  # a new run
+        mirror.sync(self.url, self.mirrors)
+        self.assertEqual(git(self.mirror, "rev-parse", "master"), sha)
+
+    def test_clone_alternates(self):
+        for repo in self.repos:
+            self.assertTrue(gpack_git.clone(repo, False))
+            with open(os.path.join(repo.directory, ".git", "objects", "info",
+                "alternates")) as f:
+                self.assertEqual(f.read().strip(), os.path.join(self.mirror, "objects"))
+        self.assertEqual(os.listdir(self.mirrors), [os.path.basename(self.mirror)])
+
+    def test_lost_race(self):
+        run_all = command.run_all
+
+        def clone_first(commands, cwd=None, env=None, on_line=None):
+            ok = run_all(commands, cwd, env, on_line)
+            temp = commands[0][-1]
+            shutil.copytree(temp, self.mirror)  # another gpack renamed its clone first
+            return ok
+
+        command.run_all = clone_first
+        try:
+            self.assertEqual(mirror.sync(self.url, self.mirrors), self.mirror)
+        finally:
+            command.run_all = run_all
+        self.assertEqual(os.listdir(self.mirrors), [os.path.basename(self.mirror)])
+
+    def test_update_from_mirror(self):
+        repo = self.repos[0]
+        gpack_git.clone(repo, False)
+        perms.apply(repo.directory, "lock")
+        write(os.path.join(self.work, "f.txt"), "new\n")
+        sha = commit(self.work, "remote")
+        mirror._synced.clear()  # a new run, the mirror fetches the commit
+        mirror.sync(self.url, self.mirrors)
+        shutil.move(self.url[len("file://"):], os.path.join(self.root, "gone.git"))
+        self.assertEqual(gpack_git.update(repo), report.UPDATED)  # without the remote
+        self.assertEqual(git(repo.directory, "rev-parse", "HEAD"), sha)
+        self.assertEqual(git(repo.directory, "rev-parse", "origin/master"), sha)
+        self.assertEqual(git(repo.directory, "remote", "get-url", "origin"), self.url)
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,82 @@
+import os
+import stat
+import sys
+import tempfile
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util import perms
+
+FILES = ["f.txt", os.path.join("d", "g.txt"), os.path.join("d", "e", "h.txt"),
+    os.path.join("other", "i.txt")]
+
+class TestPerms(TestCase):
+    """Testing the lock/unlock chmod walks"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        for path in FILES:
+            path = os.path.join(self.directory, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("x")
+        os.makedirs(os.path.join(self.directory, ".git", "refs"))
+
+    def tearDown(self):
+        perms.apply(self.directory, "unlock")
+        self.tmp.cleanup()
+
+    def writable(self, path):
+        return bool(os.stat(os.path.join(self.directory, path)).st_mode & stat.S_IWUSR)
+
+    def test_lock_unlock(self):
+        everything = FILES + ["", "d", os.path.join("d", "e"), "other"]
+        perms.apply(self.directory, "lock")
+        for path in everything:
+            self.assertFalse(self.writable(path), path)
+        self.assertTrue(self.writable(".git"))  # git metadata is never touched
+        perms.apply(self.directory, "unlock")
+        for path in everything:
+            self.assertTrue(self.writable(path), path)
+
+    def test_parallel_levels(self):
+        for i in range(perms.PARALLEL_DIRS + 1):
+            os.makedirs(os.path.join(self.directory, "many", str(i)))
+        perms.apply(self.directory, "lock", jobs=4)
+        self.assertFalse(self.writable(os.path.join("many", "0")))
+        self.assertFalse(self.writable(os.path.join("many", str(perms.PARALLEL_DIRS))))
+
+    def test_apply_paths(self):
+        perms.apply(self.directory, "lock")
+        perms.applyPaths(self.directory, [os.path.join("d", "e", "h.txt")], "unlock")
+        for path in [os.path.join("d", "e", "h.txt"), os.path.join("d", "e"), "d", ""]:
+            self.assertTrue(self.writable(path), path)  # the file and its parents
+        for path in ["f.txt", os.path.join("d", "g.txt"), "other",
+            os.path.join("other", "i.txt")]:
+            self.assertFalse(self.writable(path), path)
+
+    def test_apply_paths_directory(self):
+        perms.apply(self.directory, "lock")
+        perms.applyPaths(self.directory, ["d"], "unlock")  # such as a submodule
+        for path in ["d", os.path.join("d", "g.txt"), os.path.join("d", "e", "h.txt")]:
+            self.assertTrue(self.writable(path), path)
+        self.assertFalse(self.writable("f.txt"))
+        perms.applyPaths(self.directory, ["d"], "lock")
+        self.assertFalse(self.writable(os.path.join("d", "e", "h.txt")))
+
+    def test_symlinks(self):
+        outside = tempfile.TemporaryDirectory()
+        self.addCleanup(outside.cleanup)
+        target = os.path.join(outside.name, "t.txt")
+        with open(target, "w") as f:
+            f.write("x")
+        os.symlink(outside.name, os.path.join(self.directory, "dir-link"))
+        os.symlink(target, os.path.join(self.directory, "file-link"))
+        perms.apply(self.directory, "lock")
+        perms.applyPaths(self.directory, ["dir-link", "file-link"], "lock")
+        for path in [outside.name, target]:
+            self.assertTrue(os.stat(path).st_mode & stat.S_IWUSR, path)  # never followed
+        self.assertFalse(self.writable("f.txt"))
+
+if __name__ == "__main__":
+    test_main()
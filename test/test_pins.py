@@ -0,0 +1,86 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+from types import SimpleNamespace
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixtures import git, write, remote, commit
+import gpack
+from core.util import perms
+from core.util import pins
+from core.util import report
+from core.repo import Repo
+
+class TestPins(TestCase):
+    """Testing the GpackRepos.lock file"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = pins.path(self.tmp.name)
+        self.repo = SimpleNamespace(url="file:///remotes/a.git", branch="master")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_missing(self):
+        self.assertEqual(pins.read(self.path), {})
+
+    def test_round_trip(self):
+        pin = pins.pin(self.repo, "a" * 40, {"sub": "b" * 40})
+        pins.write(self.path, {"a": pin})
+        self.assertEqual(pins.read(self.path), {"a": pin})
+        self.assertEqual(os.listdir(self.tmp.name), [pins.NAME])
+
+    def test_stale(self):
+        pin = pins.pin(self.repo, "a" * 40, {})
+        self.assertFalse(pins.stale(self.repo, pin))
+        self.repo.branch = "develop"
+        self.assertTrue(pins.stale(self.repo, pin))
+
+    def test_invalid(self):
+        for content in ["{", "[]", '{"repos": {"a": "x"}}']:
+            with open(self.path, "w") as f:
+                f.write(content)
+            with self.assertRaises(ValueError):
+                pins.read(self.path)
+        gpack.ROOT_DIR = self.tmp.name
+        with self.assertRaises(SystemExit):  # reported once, not per repo
+            gpack.getPins()
+
+class TestFrozenRepo(TestCase):
+    """Testing install and update --frozen of one repo"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        gpack.LOCK_FILE = os.path.join(root, ".gpacklock")
+        gpack.lockState(reload=True)
+        url, self.work = remote(root, "a")
+        self.sha = git(self.work, "rev-parse", "HEAD")
+        self.directory = os.path.join(root, "a")
+        self.repo = Repo({"url": url, "local_dir": self.directory, "branch": "master"})
+        self.pins = {"a": pins.pin(self.repo, self.sha, {})}
+
+    def tearDown(self):
+        perms.apply(self.tmp.name, "unlock")
+        self.tmp.cleanup()
+
+    def test_clone_skip_and_move(self):
+        write(os.path.join(self.work, "f.txt"), "newer\n")
+        commit(self.work, "past the pin")
+        result = gpack.frozenRepo(self.repo, self.pins)
+        self.assertEqual(result.status, report.RECLONED)
+        self.assertEqual(git(self.directory, "rev-parse", "HEAD"), self.sha)
+        mode = os.stat(os.path.join(self.directory, "f.txt")).st_mode
+        self.assertFalse(mode & stat.S_IWUSR)  # locked like an install
+
+        shutil.rmtree(self.repo.url[len("file://"):])  # no network from here on
+        self.assertEqual(gpack.frozenRepo(self.repo, self.pins).status, report.CURRENT)
+
+    def test_missing_pin(self):
+        self.assertEqual(gpack.frozenRepo(self.repo, {}).status, report.FAILED)
+        self.assertFalse(os.path.exists(self.directory))
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util.process import AsyncPool
+
+def repo(name, depends_on=()):
+    return SimpleNamespace(name=name, url="file:///%s.git" % (name,),
+        depends_on=list(depends_on))
+
+class TestAsyncPool(TestCase):
+    """Testing the dependency aware AsyncPool"""
+    def test_order(self):
+        finished = []
+        mutex = threading.Lock()
+
+        def func(repo):
+            time.sleep(0.05 if repo.name == "tools" else 0)
+            with mutex:
+                finished.append(repo.name)
+            return repo.name
+
+        repos = [repo("app", ["sdk"]), repo("sdk", ["tools"]), repo("tools"),
+            repo("docs")]
+        pool = AsyncPool(func, repos, jobs=4)
+        self.assertEqual(pool.results, ["app", "sdk", "tools", "docs"])
+        self.assertTrue(finished.index("tools") < finished.index("sdk") <
+            finished.index("app"))
+        self.assertEqual(pool.critical_path(repos), ["tools", "sdk", "app"])
+
+    def test_blocked(self):
+        ran = []
+        repos = [repo("tools"), repo("sdk", ["tools"]), repo("app", ["sdk"]),
+            repo("docs")]
+        pool = AsyncPool(lambda repo: ran.append(repo.name) or repo.name, repos,
+            failed=lambda result: result == "tools",
+            blocked=lambda repo, upstream: (repo.name, upstream))
+        self.assertEqual(sorted(ran), ["docs", "tools"])
+        self.assertEqual(pool.results[1:3], [("sdk", ["tools"]), ("app", ["sdk"])])
+
+if __name__ == "__main__":
+    test_main()
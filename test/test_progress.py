@@ -0,0 +1,42 @@
+import io
+import os
+import sys
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util import progress
+
+class TestDisplay(TestCase):
+    """Testing the live view of running git jobs"""
+    def test_log_fallback(self):
+        stream = io.StringIO()
+        display = progress.Display(stream)  # not a terminal
+        display.start("a", "cloning")
+        display.line("a", "Receiving objects:  10% (1/10)")
+        display.line("a", "remote: Receiving objects:  50% (5/10), 1.00 MiB | 2.00 MiB/s")
+        display.line("a", "Resolving deltas: 100% (3/3)")
+        display.line("a", "warning: not a progress line")
+        display.line("b", "Receiving objects:  10% (1/10)")  # not started
+        display.write("gpack: message")
+        display.finish("a", "a: done")
+        self.assertEqual(stream.getvalue(), "a: cloning\na: Receiving objects\n"
+            "a: Resolving deltas\ngpack: message\na: done\n")  # no escape codes
+        self.assertEqual(display.jobs, {})
+
+    def test_job_state(self):
+        display = progress.Display(io.StringIO(), tty=False)
+        display.start("a")
+        display.line("a", "remote: Receiving objects:  50% (5/10), 1.00 MiB | 2.00 MiB/s")
+        display.line("a", "Receiving objects:  60% (6/10)")
+        self.assertEqual(display.jobs["a"], ["Receiving objects", 60, "2.00 MiB/s"])
+
+    def test_terminal(self):
+        stream = io.StringIO()
+        display = progress.Display(stream, tty=True)
+        display.start("a", "cloning")
+        display.write("gpack: message")
+        self.assertEqual(stream.getvalue(),
+            "a  cloning\n\x1b[1F\x1b[Jgpack: message\na  cloning\n")
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,65 @@
+import os
+import stat
+import sys
+import tempfile
+from types import SimpleNamespace
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util import ssh
+
+FAKE_SSH = """#!/bin/sh
+echo "$*" >> "%s"
+"""
+
+class TestSsh(TestCase):
+    """Testing ssh connection sharing against a fake GIT_SSH wrapper"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp.name, "ssh.log")
+        wrapper = os.path.join(self.tmp.name, "fake-ssh")
+        with open(wrapper, "w") as f:
+            f.write(FAKE_SSH % (self.log,))
+        os.chmod(wrapper, stat.S_IRWXU)
+        self.environ = dict(os.environ)
+        os.environ.pop("GIT_SSH_COMMAND", None)
+        os.environ["GIT_SSH"] = wrapper
+        ssh._base = None
+
+    def tearDown(self):
+        ssh.stop_masters()
+        ssh._base = None
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.tmp.cleanup()
+
+    def calls(self):
+        with open(self.log) as f:
+            return f.read().splitlines()
+
+    def test_destination(self):
+        self.assertEqual(ssh.destination("git@host:group/repo.git"), ("git@host", None))
+        self.assertEqual(ssh.destination("ssh://git@host:2222/repo.git"), ("git@host", "2222"))
+        self.assertEqual(ssh.destination("ssh://host/repo.git"), ("host", None))
+        self.assertEqual(ssh.destination("https://host/repo.git"), None)
+        self.assertEqual(ssh.destination("file:///remotes/repo.git"), None)
+        self.assertEqual(ssh.destination("/remotes/repo.git"), None)
+
+    def test_multiplex(self):
+        repos = [SimpleNamespace(url=url) for url in ["git@host:a.git",
+            "git@host:b.git", "ssh://git@other:2222/c.git", "https://web/d.git"]]
+        ssh.multiplex(repos)
+        control = ssh._control_dir
+        self.assertTrue("ControlPath=%s/%%C" % (control,) in os.environ["GIT_SSH_COMMAND"])
+        masters = sorted(call for call in self.calls() if "-N" in call.split())
+        self.assertEqual(len(masters), 2)  # one per host
+        self.assertTrue(masters[0].startswith("-o ControlMaster=yes"))
+        self.assertTrue(masters[0].endswith("-p 2222 git@other"))
+
+        ssh.remove_key(self.tmp.name)
+        exits = [call for call in self.calls() if call.startswith("-O exit")]
+        self.assertEqual(len(exits), 2)
+        self.assertFalse(os.path.isdir(control))
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.util import command
+from core.util import trace
+
+@trace.traced("sync phase")
+def phase(repo):
+    return command.run(["git", "--version"]).ok
+
+@trace.traced("async phase")
+async def async_phase(repo):
+    return await command.run_all_async([["git", "--version"]])
+
+class TestTrace(TestCase):
+    """Testing the Chrome trace-event export"""
+    def setUp(self):
+        trace.enable()
+        del trace._events[:]
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        trace._enabled = False
+        del trace._events[:]
+        self.tmp.cleanup()
+
+    def export(self):
+        path = os.path.join(self.tmp.name, "out.json")
+        trace.export(path)
+        with open(path) as f:
+            return json.load(f)
+
+    def test_export(self):
+        repo = SimpleNamespace(name="a", url="file:///a.git")
+        self.assertTrue(phase(repo))
+        self.assertTrue(asyncio.run(async_phase(repo)))
+        data = self.export()
+        events = data["traceEvents"]
+        self.assertEqual([event["ts"] for event in events],
+            sorted(event["ts"] for event in events))
+        names = [event["name"] for event in events]
+        self.assertEqual(names.count("git"), 2)
+        self.assertTrue("sync phase" in names and "async phase" in names)
+        for event in events:
+            self.assertEqual(event["ph"], "X")
+            self.assertEqual(event["args"]["repo"], "a")  # commands are tagged too
+        git = [event for event in events if event["cat"] == "command"][0]
+        self.assertEqual((git["args"]["argv"], git["args"]["exit"]),
+            (["git", "--version"], 0))
+
+    def test_disabled(self):
+        trace._enabled = False
+        phase(SimpleNamespace(name="a", url="file:///a.git"))
+        self.assertEqual(self.export()["traceEvents"], [])
+
+    def test_label(self):
+        self.assertEqual(trace.label(["git", "-c", "a=b", "-C", "dir", "status", "-s"]),
+            "git status")
+
+if __name__ == "__main__":
+    test_main()
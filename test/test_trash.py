@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import time
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixtures import git, write, remote, commit
+import gpack
+from core.util import perms
+from core.util import trash
+
+class TestTrash(TestCase):
+    """Testing the uninstall trash"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        perms.apply(self.root, "unlock")
+        self.tmp.cleanup()
+
+    def tree(self, name):
+        directory = os.path.join(self.root, name)
+        os.makedirs(os.path.join(directory, "d", "e"))
+        for path in ["f", os.path.join("d", "g"), os.path.join("d", "e", "h")]:
+            with open(os.path.join(directory, path), "w") as f:
+                f.write("x")
+        perms.apply(directory, "lock")
+        return directory
+
+    def test_discard_and_empty(self):
+        for name in ["a", "b"]:
+            directory = self.tree(name)
+            trash.discard(directory, self.root)
+            self.assertFalse(os.path.exists(directory))
+        self.assertEqual(len(os.listdir(trash.path(self.root))), 2)
+        trash.empty(self.root)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_empty_without_trash(self):
+        trash.empty(self.root)
+        trash.emptyInBackground(self.root)  # nothing to spawn
+        self.assertEqual(os.listdir(self.root), [])
+
+class TestUpdateTrash(TestCase):
+    """Testing the trash of a repo re-cloned by update"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        gpack.ROOT_DIR = self.root
+        gpack.LOCK_FILE = os.path.join(self.root, ".gpacklock")
+        gpack.lockState(reload=True)
+        url, self.work = remote(self.root, "a")
+        self.directory = os.path.join(self.root, "a")
+        git(self.root, "clone", "-q", url, self.directory)
+        write(os.path.join(self.root, "GpackRepos"),
+            "a:\n    url: %s\n    local_dir: %s\n    branch: master\n" % (url, self.directory))
+
+    def tearDown(self):
+        perms.apply(self.root, "unlock")
+        self.tmp.cleanup()
+
+    def test_single_repo(self):
+        write(os.path.join(self.directory, "f.txt"), "local\n")
+        git(self.directory, "commit", "-q", "-am", "local")
+        write(os.path.join(self.work, "f.txt"), "remote\n")
+        remote_sha = commit(self.work, "remote")  # the pull conflicts, update re-clones
+        perms.apply(self.directory, "lock")
+        gpack.parseArgs(["update", "a"])
+        self.assertEqual(git(self.directory, "rev-parse", "HEAD"), remote_sha)
+        deadline = time.time() + 10
+        while os.path.exists(trash.path(self.root)) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(os.path.exists(trash.path(self.root)))  # emptied in the background
+
+if __name__ == "__main__":
+    test_main()
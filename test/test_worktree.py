@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+from unittest import main as test_main, TestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixtures import git, remote, commit
+from core.util import command
+from core.util import git as gpack_git
+from core.util import manifest
+from core.util import trash
+from core.util import worktree
+from core.repo import Repo
+
+class TestWorktree(TestCase):
+    """Testing branches of one url checked out as worktrees"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        url, self.work = remote(self.root, "a")
+        git(self.work, "push", "-q", "origin", "HEAD:release")
+        worktree._synced.clear()  # shared clones are synced once per process
+        self.repos = [Repo({"url": url, "local_dir": os.path.join(self.root, name),
+            "branch": branch, "worktree": os.path.join(self.root, "shared")})
+            for name, branch in [("main", "master"), ("rel", "release")]]
+        self.shared = worktree.path(url, self.repos[0].worktree)
+
+    def tearDown(self):
+        trash.empty(self.root)
+        self.tmp.cleanup()
+
+    def test_add(self):
+        for repo in self.repos:
+            self.assertTrue(repo.clone())
+        self.assertTrue(os.path.isdir(self.shared))
+        for repo in self.repos:
+            self.assertTrue(os.path.isfile(os.path.join(repo.directory, ".git")))
+            self.assertEqual(gpack_git.current_branch(repo).strip(), repo.branch)
+            self.assertTrue(gpack_git.commitsMatch(repo))
+        listing = git(self.shared, "worktree", "list", "--porcelain")
+        self.assertEqual(listing.count("worktree "), 3)  # the bare clone and two
+
+    def test_one_fetch(self):
+        for repo in self.repos:
+            repo.clone()
+        commit(self.work, "master tip")
+        commit(self.work, "release tip", branch="release")
+        worktree._synced.clear()  # a new run
+        self.assertTrue(gpack_git.fetch(self.repos[0]))
+        for repo in self.repos:  # the second worktree sees the fetch too
+            self.assertFalse(gpack_git.commitsMatch(repo))
+            self.assertTrue(command.run_all(gpack_git.pull_steps(repo)[:1],
+                cwd=repo.directory))
+            self.assertTrue(gpack_git.commitsMatch(repo))
+
+    def test_remove(self):
+        for repo in self.repos:
+            repo.clone()
+        worktree.remove(self.repos[0], self.root)
+        self.assertFalse(os.path.exists(self.repos[0].directory))
+        self.assertTrue(os.path.isdir(self.shared))  # still used by rel
+        listing = git(self.shared, "worktree", "list", "--porcelain")
+        self.assertEqual(listing.count("worktree "), 2)
+        worktree.remove(self.repos[1], self.root)
+        self.assertFalse(os.path.exists(self.repos[1].directory))
+        self.assertFalse(os.path.exists(self.shared))  # gone with its last worktree
+
+    def test_readd_after_manual_delete(self):
+        repo = self.repos[0]
+        repo.clone()
+        trash.discard(repo.directory, self.root)
+        self.assertTrue(repo.clone())  # the stale worktree is pruned first
+
+    def test_same_branch(self):
+        path = os.path.join(self.root, "GpackRepos")
+        with open(path, "w") as f:
+            f.write("config:\n    worktree: %s\n" % (os.path.join(self.root, "shared"),))
+            for name in ["t1", "t2"]:  # like test1 and test3 of GpackRepos.example
+                f.write("%s:\n    url: %s\n    local_dir: %s\n    branch: master\n"
+                    % (name, self.repos[0].url, os.path.join(self.root, name)))
+        first, second = manifest.Manifest(manifest.read(path)).repos
+        self.assertEqual((first.worktree, second.worktree), (self.repos[0].worktree, None))
+        for repo in [first, second]:
+            self.assertTrue(repo.clone())
+            self.assertEqual(gpack_git.current_branch(repo).strip(), "master")
+        self.assertTrue(os.path.isfile(os.path.join(first.directory, ".git")))
+        self.assertTrue(os.path.isdir(os.path.join(second.directory, ".git")))  # a clone
+
+if __name__ == "__main__":
+    test_main()